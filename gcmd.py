@@ -6,23 +6,76 @@ import sys
 import argparse
 
 try:
-    from remote import serverGroup, sshLoginException
+    from remote import serverGroup, sshLoginException, sshCmdException
+    from trovitdb.inventory import inventorySnapshot
     from trovitdb.racktables import racktables
+    from trovitdb.target import parseTarget, matchTarget, targetException
 except ImportError as ie:
     print(ie)
     sys.exit(1)
 
 
+def printHeader(hostname, newline):
+    if newline:
+        print('\n\033[1;33m=====> %s <=====\033[0m' % hostname)
+    else:
+        print('\033[1;33m%s\033[0m: ' % hostname, end='')
+    return
+
+
+def parallelCmd(sshOps, servers, args):
+    """ Run the command in several servers at once, printing the output of
+    each server as soon as it finishes """
+    for hostname, output, error in sshOps.sshParallelCmd(
+            [server[1] for server in servers], ' '.join(args.command),
+            workers=args.workers, timeout=args.timeout):
+        printHeader(hostname, args.newline)
+        if error is not None:
+            print(error)
+            continue
+        sys.stdout.write(''.join(output[0]))
+        for line in output[1]:
+            print("\033[1;31m*\033[0m %s" % line, end='')
+    return
+
+
+def selectServers(args):
+    """ Return the servers matching the -k expression. Name regexes alone
+    are answered by the local inventory, other expressions by Racktables """
+    terms = parseTarget(args.key)
+    if all([key == 're' for negated, key, values in terms]):
+        return matchTarget(terms,
+                           inventorySnapshot().getActiveServers(args.refresh))
+    with racktables(readOnly=True) as rt:
+        rt.connect()
+        return rt.getServersByTarget(terms)
+
+
 def main():
     hlpDsc = "Send a command to multiple servers"
     optParser = argparse.ArgumentParser(description=hlpDsc)
-    optParser.add_argument("-k", "--key", help="pattern in servername",
-                           metavar="STRING", required=False, type=str,
-                           dest="key", default='')
+    optParser.add_argument("-k", "--key", help="servername pattern or "
+                           "targeting expression, e.g. 'tag:prod os:8 "
+                           "!name:*-old net:10.2.0.0/16' (keys: name, re, "
+                           "tag, type, os, model, net)", metavar="STRING",
+                           required=False, type=str, dest="key",
+                           default='')
     optParser.add_argument("-n", "--no-newline", help="don't add a new line"
                            "with the servername in the output",
                            required=False, action='store_false',
                            dest="newline", default=True)
+    optParser.add_argument("-P", "--parallel", help="number of servers to "
+                           "run the command on at the same time",
+                           metavar="N", required=False, type=int,
+                           dest="workers", default=1)
+    optParser.add_argument("-t", "--timeout", help="connection and command "
+                           "timeout (seconds) for each server in parallel "
+                           "mode", metavar="SECONDS", required=False,
+                           type=int, dest="timeout", default=60)
+    optParser.add_argument("-r", "--refresh", help="rebuild the local "
+                           "inventory of servers from Racktables",
+                           required=False, action='store_true',
+                           dest="refresh", default=False)
     optParser.add_argument("command", help="command line to execute",
                            metavar="shell command", nargs='*')
     args = optParser.parse_args()
@@ -30,18 +83,21 @@ def main():
         optParser.print_help()
         sys.exit(2)
     try:
-        sshOps = serverGroup()
-        with racktables() as rt:
-            rt.connect()
-            for server in rt.getServersByName(args.key):
-                if args.newline:
-                    print('\n\033[1;33m=====> %s <=====\033[0m' % server[1])
-                else:
-                    print('\033[1;33m%s\033[0m: ' % server[1], end='')
+        with serverGroup() as sshOps:
+            servers = selectServers(args)
+            if args.workers > 1:
+                parallelCmd(sshOps, servers, args)
+                return
+            for server in servers:
+                printHeader(server[1], args.newline)
                 try:
                     sshOps.sshCmd(server[1], ' '.join(args.command))
-                except sshLoginException as sLE:
-                    print(sLE)
+                except (sshLoginException, sshCmdException) as sE:
+                    # A broken host doesn't stop the rest of the fleet
+                    print(sE)
+    except targetException as tE:
+        print(tE)
+        sys.exit(2)
     except KeyboardInterrupt:
         sys.exit(3)
     return
@@ -8,7 +8,7 @@ from sys import exit
 import argparse
 
 try:
-    from trovitdb.racktables import racktables
+    from trovitdb.inventory import inventorySnapshot
 except ImportError as ie:
     print(ie)
     exit(1)
@@ -23,14 +23,16 @@ def main():
     optParser.add_argument("-d", "--directory", help="target directory"
                            "for the symlinks", metavar="STRING", type=str,
                            required=False, dest="dir", default=getcwd())
+    optParser.add_argument("-r", "--refresh", help="rebuild the local "
+                           "inventory of servers from Racktables",
+                           required=False, action='store_true',
+                           dest="refresh", default=False)
     args = optParser.parse_args()
     try:
-        with racktables() as rt:
-            rt.connect()
-            for server in rt.getActiveServers():
-                target = '%s%s%s' % (args.dir, sep, server[1])
-                if not lexists(target):
-                    symlink(args.fastssh, target)
+        for server in inventorySnapshot().getActiveServers(args.refresh):
+            target = '%s%s%s' % (args.dir, sep, server[1])
+            if not lexists(target):
+                symlink(args.fastssh, target)
     except KeyboardInterrupt:
         exit(2)
     return
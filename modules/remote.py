@@ -2,13 +2,22 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import print_function
+import atexit
+import json
+import re
 import socket
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from time import time
+from threadPool import runPool
 from trovitconf import trovitconf, trovitconfError
+from trovitstats import stats
 from pwd import getpwuid
-from os import getuid
+from os import getuid, rename
+from os.path import expanduser
 from getpass import getpass
 from select import select
-from re import sub
 
 try:
     import paramiko
@@ -17,19 +26,358 @@ except ImportError as ie:
     raise
 
 
+# Where the user that last logged in successfully on each host is stored
+SSH_USERS_FILE = expanduser('~/.trovit-ssh-users.json')
+SSH_USERS_TTL = 7 * 86400
+# Facts gathered from the hosts by serverGroup.collectFacts()
+HOST_FACTS_FILE = expanduser('~/.trovit-host-facts.json')
+HOST_FACTS_TTL = 3600
+# Commands run (as a single one) to gather the facts of a host
+FACTS_SECTIONS = OrderedDict([('os', 'cat /etc/debian_version'),
+                              ('kernel', 'uname -r'),
+                              ('ipaddr', 'ip a l')])
+FACTS_MARKER = '@@trovit-facts@@ '
+
+_ifacePtrn = re.compile('^[0-9]+: (?P<iface>[^:@]+)')
+# Addresses without broadcast (loopback aliases, /32 VIPs) aren't taken
+_ipPtrn = re.compile('inet (?P<ip>[0-9\.]+/[0-9]+) brd')
+_macPtrn = re.compile('link/ether (?P<mac>[0-9a-f:]+)')
+
+
 class sshLoginException(Exception):
     pass
 
 
+class sshCmdException(Exception):
+    pass
+
+
+class jsonCache:
+    """
+    Values stored by hostname in a JSON file shared by all the scripts.
+    Entries expire after ttl seconds and the changes are merged with the
+    ones written by other processes when they are saved.
+    """
+    def __init__(self, path, ttl):
+        self._path = path
+        self._ttl = ttl
+        self._entries = None
+        self._changes = dict()
+        self._lock = threading.Lock()
+        return
+
+    def _load(self):
+        """ Read the file the first time it's needed (lock must be held) """
+        if self._entries is None:
+            try:
+                with open(self._path) as cacheFile:
+                    self._entries = json.load(cacheFile)
+            except (IOError, ValueError):
+                self._entries = dict()
+        return self._entries
+
+    def get(self, hostname, ttl=None):
+        """
+        Return the value stored for hostname, or None if there is no
+        valid entry.
+
+        Keywords:
+          @hostname (str): server name
+          @ttl (int): maximum age in seconds, by default the cache TTL
+        """
+        if ttl is None:
+            ttl = self._ttl
+        with self._lock:
+            entry = self._load().get(hostname)
+        if entry is None or time() - entry[1] > ttl:
+            return None
+        return entry[0]
+
+    def set(self, hostname, value):
+        """
+        Store the value for hostname.
+        """
+        with self._lock:
+            entry = [value, time()]
+            self._load()[hostname] = entry
+            self._changes[hostname] = entry
+        return
+
+    def invalidate(self, hostname):
+        """
+        Forget the value stored for hostname.
+        """
+        with self._lock:
+            if self._load().pop(hostname, None) is not None:
+                self._changes[hostname] = None
+        return
+
+    def save(self):
+        """
+        Write the changes to disk, merged with the entries written by other
+        processes in the meantime.
+        """
+        with self._lock:
+            if len(self._changes) == 0:
+                return
+            self._entries = None
+            entries = self._load()
+            for hostname, entry in self._changes.items():
+                if entry is None:
+                    entries.pop(hostname, None)
+                else:
+                    entries[hostname] = entry
+            try:
+                with open('%s.tmp' % self._path, 'w') as cacheFile:
+                    json.dump(entries, cacheFile)
+                rename('%s.tmp' % self._path, self._path)
+            except (IOError, OSError) as err:
+                print("Error saving %s (%s)" % (self._path, err))
+            self._changes = dict()
+        return
+
+
+class sshUserCache(jsonCache):
+    """
+    Username that worked the last time for each host, kept in a JSON file
+    so the next logins try it first. Entries are removed when the login
+    with that user fails.
+    """
+    def __init__(self, path=SSH_USERS_FILE, ttl=SSH_USERS_TTL):
+        jsonCache.__init__(self, path, ttl)
+        return
+
+
+class hostFactsCache(jsonCache):
+    """
+    Facts gathered from each host (see parseFacts), kept in a JSON file so
+    all the inventory scripts can use the same collection pass.
+    """
+    def __init__(self, path=HOST_FACTS_FILE, ttl=HOST_FACTS_TTL):
+        jsonCache.__init__(self, path, ttl)
+        return
+
+
+def parseIpAddr(stdout):
+    """
+    Parse the output of 'ip a l'.
+
+    Keywords:
+      @stdout (list): output lines
+    Return:
+      dict{str(iface): {'mac': str(MAC), 'ip': list[str(cidr)]}}
+    """
+    iface = None
+    netInfo = dict()
+    for line in stdout:
+        ifaceInfo = _ifacePtrn.search(line)
+        if ifaceInfo is not None:
+            iface = ifaceInfo.group('iface')
+            netInfo[iface] = {'mac': '000000000000', 'ip': list()}
+            continue
+        if iface is None:
+            continue
+        ipInfo = _ipPtrn.search(line)
+        if ipInfo is not None:
+            netInfo[iface]['ip'].append(ipInfo.group('ip'))
+        macInfo = _macPtrn.search(line)
+        if macInfo is not None:
+            netInfo[iface]['mac'] = macInfo.group('mac').upper().replace(':',
+                                                                         '')
+    return netInfo
+
+
+def factsCommand():
+    """
+    Build the command that gathers all the facts of a host at once, the
+    output of every section preceded by a marker line.
+    """
+    return '; '.join(["echo '%s%s'; %s 2>/dev/null" % (FACTS_MARKER, name,
+                                                       cmd)
+                      for name, cmd in FACTS_SECTIONS.items()])
+
+
+def parseFacts(stdout):
+    """
+    Split the output of factsCommand() into a facts record.
+
+    Keywords:
+      @stdout (list): output lines
+    Return:
+      dict{'os': str(debian version), 'kernel': str,
+           'interfaces': dict (see parseIpAddr)}
+    """
+    sections = dict((name, list()) for name in FACTS_SECTIONS)
+    current = None
+    for line in stdout:
+        if line.startswith(FACTS_MARKER):
+            current = line[len(FACTS_MARKER):].strip()
+            sections.setdefault(current, list())
+        elif current is not None:
+            sections[current].append(line)
+    firstLine = lambda lines: lines[0].strip() if len(lines) > 0 else ''
+    return {'os': firstLine(sections['os']),
+            'kernel': firstLine(sections['kernel']),
+            'interfaces': parseIpAddr(sections['ipaddr'])}
+
+
+_sshUsers = sshUserCache()
+atexit.register(_sshUsers.save)
+_hostFacts = hostFactsCache()
+atexit.register(_hostFacts.save)
+
+
+class lineBuffer:
+    """
+    Split a stream of data chunks in lines without blocking for the end of
+    line. Partial lines longer than maxLine are released as they are, so
+    memory stays bounded.
+    """
+    def __init__(self, maxLine=65536):
+        self._maxLine = maxLine
+        self._chunks = list()
+        self._size = 0
+        return
+
+    def feed(self, data):
+        """
+        Add a chunk of data and return the lines completed with it.
+
+        Keywords:
+          @data (str): received data
+        Return:
+          list[str(line), ...] (without the line break)
+        """
+        if '\n' not in data:
+            self._chunks.append(data)
+            self._size += len(data)
+            if self._size > self._maxLine:
+                return self.flush()
+            return list()
+        self._chunks.append(data)
+        lines = ''.join(self._chunks).split('\n')
+        partial = lines.pop()
+        self._chunks = [partial] if partial != '' else list()
+        self._size = len(partial)
+        return lines
+
+    def flush(self):
+        """
+        Return the pending partial line, if any.
+
+        Keywords:
+          None
+        Return:
+          list[str(line)]
+        """
+        if self._size == 0:
+            self._chunks = list()
+            return list()
+        line = ''.join(self._chunks)
+        self._chunks = list()
+        self._size = 0
+        return [line]
+
+
+class sshStreamMux:
+    """
+    Print the stdout and stderr of several SSH channels as they arrive,
+    using a single select() loop for all of them.
+    """
+    def __init__(self, bufSize=4096):
+        self._bufSize = bufSize
+        self._channels = dict()
+        return
+
+    def add(self, channel, label=None, hostname=None):
+        """
+        Register a channel which already started its command.
+
+        Keywords:
+          @channel (paramiko.Channel): channel to read from
+          @label (str): text prefixed to each line (usually the hostname)
+          @hostname (str): server of the channel for the stats, by default
+                           the label
+        Return:
+          None
+        """
+        self._channels[channel] = {'label': label,
+                                   'hostname': hostname or label,
+                                   'started': stats.start(),
+                                   'bytes': 0,
+                                   'out': lineBuffer(),
+                                   'err': lineBuffer()}
+        return
+
+    def _print(self, label, lines, srcType='out'):
+        """
+        Print in fancy mode the stdout or stderr lines of a SSH Channel.
+        """
+        color = 2 if srcType == 'out' else 1
+        decorator = "\033[1;3%sm*\033[0m" % color
+        if label is not None:
+            decorator = "%s %s:" % (decorator, label)
+        for line in lines:
+            print("%s %s" % (decorator, line))
+        return
+
+    def _drain(self, channel):
+        """
+        Read all the data available in a channel without blocking.
+        Return: boolean (True when the command finished and the channel
+                has no more data)
+        """
+        info = self._channels[channel]
+        while channel.recv_ready():
+            data = channel.recv(self._bufSize)
+            info['bytes'] += len(data)
+            self._print(info['label'], info['out'].feed(data))
+        while channel.recv_stderr_ready():
+            data = channel.recv_stderr(self._bufSize)
+            info['bytes'] += len(data)
+            self._print(info['label'], info['err'].feed(data), 'err')
+        return channel.exit_status_ready() and not channel.recv_ready() \
+            and not channel.recv_stderr_ready()
+
+    def run(self):
+        """
+        Loop until the commands of all the channels finish.
+
+        Keywords:
+          None
+        Return:
+          dict{label: int(exit code)}
+        """
+        exitCodes = dict()
+        pending = self._channels.keys()
+        while len(pending) > 0:
+            rObj, wObj, xObj = select(pending, [], [], 1.0)
+            # The exit status may come without any data left to wake select
+            for channel in set(rObj + [c for c in pending
+                                       if c.exit_status_ready()]):
+                if not self._drain(channel):
+                    continue
+                info = self._channels[channel]
+                self._print(info['label'], info['out'].flush())
+                self._print(info['label'], info['err'].flush(), 'err')
+                exitCodes[info['label']] = channel.recv_exit_status()
+                stats.ssh(info['hostname'], 'transfer', info['started'],
+                          size=info['bytes'])
+                channel.close()
+                pending.remove(channel)
+        return exitCodes
+
+
 class remoteServer:
-    def __init__(self, hostname, password):
+    def __init__(self, hostname, password, timeout=60, port=22):
         self._sckBS = 4096
         self._sshCli = paramiko.SSHClient()
         self._sshCli.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         self._sshCred = {'username': getpwuid(getuid())[0],
                          'hostname': hostname,
+                         'port': port,
                          'allow_agent': True,
-                         'timeout': 60,
+                         'timeout': timeout,
                          'password': password}
         self._catchExcpts = ['sshLoginException']
         self._sshLogin()
@@ -47,6 +395,30 @@ class remoteServer:
                 return True
         return
 
+    def isAlive(self):
+        """
+        Check if the SSH transport is still usable.
+
+        Keywords:
+          None
+        Return:
+          boolean
+        """
+        sshTrans = self._sshCli.get_transport()
+        return sshTrans is not None and sshTrans.is_active()
+
+    def close(self):
+        """
+        Close the SSH connection.
+
+        Keywords:
+          None
+        Return:
+          None
+        """
+        self._sshCli.close()
+        return
+
     def _sshConnection(self):
         """
         Establish the connection with the remote server and handle possible
@@ -57,8 +429,23 @@ class remoteServer:
         Return:
           None
         """
+        hostname = self._sshCred['hostname']
         try:
-            self._sshCli.connect(**self._sshCred)
+            # The TCP connection is opened here, so its time is measured
+            # apart from the SSH handshake and the authentication
+            started = stats.start()
+            sock = socket.create_connection((hostname,
+                                             self._sshCred['port']),
+                                            self._sshCred['timeout'])
+            stats.ssh(hostname, 'connect', started)
+            started = stats.start()
+            try:
+                self._sshCli.connect(sock=sock, **self._sshCred)
+            except:
+                # paramiko doesn't close a socket it didn't open
+                sock.close()
+                raise
+            stats.ssh(hostname, 'auth', started)
         except paramiko.AuthenticationException:
             return False
         except paramiko.SSHException as se:
@@ -80,96 +467,435 @@ class remoteServer:
         Return:
           None
         """
-        errorMsg = '[SSH]: <%s>' % self._sshCred['hostname']
-        sshUsers = ['root']
-        if self._sshCred['hostname'][:7] == 'vpc-nat':
-            sshUsers.insert(0, 'admin')
+        hostname = self._sshCred['hostname']
+        errorMsg = '[SSH]: <%s>' % hostname
+        sshUsers = [self._sshCred['username'], 'root']
+        if hostname[:7] == 'vpc-nat':
+            sshUsers.append('admin')
+        # Start with the user that worked the last time
+        lastUser = _sshUsers.get(hostname)
+        if lastUser is not None:
+            if lastUser in sshUsers:
+                sshUsers.remove(lastUser)
+            sshUsers.insert(0, lastUser)
         try:
-            while not self._sshConnection():
-                self._sshCred['username'] = sshUsers.pop()
+            for username in sshUsers:
+                self._sshCred['username'] = username
+                if self._sshConnection():
+                    # Refreshed on every login, so the hosts in use don't
+                    # expire
+                    _sshUsers.set(hostname, username)
+                    return
+                if username == lastUser:
+                    _sshUsers.invalidate(hostname)
         except sshLoginException as sLE:
             raise sshLoginException("%s %s" % (errorMsg, sLE.message))
-        except IndexError:
-            raise sshLoginException("%s Auth Error" % errorMsg)
-        return
+        raise sshLoginException("%s Auth Error" % errorMsg)
 
-    def _parseResponse(self, channel, srcType='out'):
+    def sshStreamCmd(self, cmd):
         """
-        Print in fancy mode the stdout or stderr streams of a SSH Channel.
+        Execute one command on the remote server and prints the output (and
+        error) as it arrives.
 
         Keywords:
-          @channel (SSHChannel): Paramiko SSH Channel to work in
-          @srcType (str): Type of message [ out | err ]
+          @cmd (str): command to execute
         Return:
-          None
+          int (exit code of the command)
         """
-        data = ''
-        color = 2 if srcType == 'out' else 1
-        decorator = "\033[1;3%sm*\033[0m" % color
-        while len(data) == 0 or data[-1] != '\n':
-            if srcType == 'out':
-                data += channel.recv(self._sckBS)
-            elif srcType == 'err':
-                data += channel.recv_stderr(self._sckBS)
-        output = "%s %s" % (decorator, sub('\n', '\n%s ' % decorator,
-                                           data[:-1]))
-        print(output)
-        return
+        mux = sshStreamMux(self._sckBS)
+        mux.add(self.openChannel(cmd), hostname=self._sshCred['hostname'])
+        return mux.run()[None]
 
-    def sshStreamCmd(self, cmd):
+    def openChannel(self, cmd):
         """
-        Execute one command on the remote server and prints the output (and
-        error).
+        Open a new session on the SSH transport and start a command in it.
 
         Keywords:
           @cmd (str): command to execute
         Return:
-          None
+          paramiko.Channel
         """
         sshTrans = self._sshCli.get_transport()
-        sshChan = sshTrans.open_session()
-        sshChan.exec_command(cmd)
-        while not sshChan.exit_status_ready():
-            rObj, wObj, xObj = select([sshChan], [], [], 1.0)
-            if len(rObj) > 0:
-                if sshChan.recv_ready():
-                    self._parseResponse(sshChan)
-                if sshChan.recv_stderr_ready():
-                    self._parseResponse(sshChan, srcType='err')
-        sshChan.close()
-        return
+        started = stats.start()
+        try:
+            sshChan = sshTrans.open_session()
+            sshChan.exec_command(cmd)
+            stats.ssh(self._sshCred['hostname'], 'exec', started)
+        except (paramiko.SSHException, AttributeError) as se:
+            raise sshCmdException("[SSH]: <%s> %s"
+                                  % (self._sshCred['hostname'], se))
+        return sshChan
 
-    def sshSyncCmd(self, cmd):
+    def sshSyncCmd(self, cmd, timeout=None):
         """
         Execute one command on the remote server and return a tuple with stdout
         and stderr lines.
 
         Keywords:
           @cmd (str): command to execute
+          @timeout (int): seconds without data before giving up
         Return:
           tuple(list[stdout], list[stderr])
         """
         output, error = '', ''
-        stdin, stdout, stderr = self._sshCli.exec_command(cmd)
-        output = stdout.readlines()
-        error = stderr.readlines()
+        hostname = self._sshCred['hostname']
+        try:
+            started = stats.start()
+            stdin, stdout, stderr = self._sshCli.exec_command(cmd,
+                                                              timeout=timeout)
+            stats.ssh(hostname, 'exec', started)
+            started = stats.start()
+            output = stdout.readlines()
+            error = stderr.readlines()
+            stats.ssh(hostname, 'transfer', started, (output, error))
+        except socket.timeout:
+            raise sshCmdException("[SSH]: <%s> Command Timeout"
+                                  % self._sshCred['hostname'])
+        except paramiko.SSHException as se:
+            raise sshCmdException("[SSH]: <%s> %s"
+                                  % (self._sshCred['hostname'], se))
         return (output, error)
 
 
+class sshConnCache:
+    """
+    Authenticated SSH connections kept open by hostname, so several commands
+    on the same server reuse the same transport. Connections are evicted
+    when they are idle for too long, when the cache is full (least recently
+    used first) or when their transport is dead.
+    """
+    def __init__(self, password, maxConns=32, idleTimeout=300, timeout=60):
+        self._password = password
+        self._maxConns = maxConns
+        self._idleTimeout = idleTimeout
+        self._timeout = timeout
+        self._conns = OrderedDict()
+        self._lock = threading.Lock()
+        return
+
+    @contextmanager
+    def connection(self, hostname, timeout=None):
+        """
+        Context manager returning a connected remoteServer for hostname.
+
+        Keywords:
+          @hostname (str): server to connect to
+          @timeout (int): connection timeout when a new login is needed
+        Return:
+          remoteServer
+        """
+        server = self.acquire(hostname, timeout)
+        try:
+            yield server
+        finally:
+            self.release(hostname, server)
+
+    def discard(self, hostname):
+        """
+        Close and forget the cached connection for hostname.
+
+        Keywords:
+          @hostname (str): server name
+        Return:
+          None
+        """
+        with self._lock:
+            entry = self._conns.get(hostname)
+            if entry is not None and entry['users'] == 0:
+                del self._conns[hostname]
+                entry['server'].close()
+        return
+
+    def closeAll(self):
+        """
+        Close all the cached connections.
+
+        Keywords:
+          None
+        Return:
+          None
+        """
+        with self._lock:
+            conns, self._conns = self._conns, OrderedDict()
+        for entry in conns.values():
+            entry['server'].close()
+        return
+
+    def acquire(self, hostname, timeout=None):
+        """
+        Return a connected remoteServer for hostname, which can't be evicted
+        until it's given back with release().
+
+        Keywords:
+          @hostname (str): server to connect to
+          @timeout (int): connection timeout when a new login is needed
+        Return:
+          remoteServer
+        """
+        with self._lock:
+            entry = self._conns.get(hostname)
+            if entry is not None and entry['users'] == 0 \
+               and (not entry['server'].isAlive()
+                    or time() - entry['lastUse'] > self._idleTimeout):
+                del self._conns[hostname]
+                entry['server'].close()
+                entry = None
+            if entry is not None:
+                entry['users'] += 1
+                # Move it to the most recently used end
+                del self._conns[hostname]
+                self._conns[hostname] = entry
+                return entry['server']
+        if timeout is None:
+            timeout = self._timeout
+        server = remoteServer(hostname, self._password, timeout)
+        with self._lock:
+            if hostname not in self._conns:
+                self._conns[hostname] = {'server': server,
+                                         'users': 1,
+                                         'lastUse': time()}
+        return server
+
+    def release(self, hostname, server):
+        """
+        Give back a connection taken with acquire().
+
+        Keywords:
+          @hostname (str): server name
+          @server (remoteServer): connection to release
+        Return:
+          None
+        """
+        with self._lock:
+            entry = self._conns.get(hostname)
+            if entry is None or entry['server'] is not server:
+                # Connection opened by a concurrent checkout, not cached
+                server.close()
+                return
+            entry['users'] -= 1
+            entry['lastUse'] = time()
+            self._evict()
+        return
+
+    def _evict(self):
+        """ Remove idle expired and least recently used connections (must be
+        called with the lock held) """
+        now = time()
+        unused = [hostname for hostname, entry in self._conns.items()
+                  if entry['users'] == 0]
+        excess = len(self._conns) - self._maxConns
+        for hostname in unused:
+            entry = self._conns[hostname]
+            if excess > 0 or now - entry['lastUse'] > self._idleTimeout \
+               or not entry['server'].isAlive():
+                del self._conns[hostname]
+                entry['server'].close()
+                excess -= 1
+        return
+
+
+class sshExecutor:
+    """
+    Run the same command on many servers concurrently, using a pool of
+    worker threads with one SSH session each. If a connection cache is
+    given, sessions are taken from it instead of opening new ones.
+    """
+    def __init__(self, password, workers=8, timeout=60, cache=None):
+        self._password = password
+        self._workers = workers
+        self._timeout = timeout
+        self._cache = cache
+        return
+
+    def _connection(self, hostname):
+        if self._cache is not None:
+            return self._cache.connection(hostname, self._timeout)
+        return remoteServer(hostname, self._password, self._timeout)
+
+    def _runCmd(self, hostname, cmd):
+        """
+        Run cmd on a server.
+
+        Keywords:
+          @hostname (str): server to connect to
+          @cmd (str): command to execute
+        Return:
+          tuple(list[stdout], list[stderr])
+        """
+        try:
+            with self._connection(hostname) as server:
+                return server.sshSyncCmd(cmd, self._timeout)
+        except (sshLoginException, sshCmdException):
+            raise
+        except Exception as e:
+            raise sshCmdException("[SSH]: <%s> %s" % (hostname, e))
+
+    def run(self, hostnames, cmd, ordered=False):
+        """
+        Execute one command on every server given.
+
+        Keywords:
+          @hostnames (list): servers to connect to
+          @cmd (str): command to execute
+          @ordered (bool): yield the results in the same order as hostnames
+                           instead of the completion order
+        Return:
+          iterator[tuple(str(hostname), tuple(list[stdout], list[stderr]),
+                         Exception or None)]
+        """
+        waiting = dict()
+        nextIdx = 0
+        for idx, hostname, output, error in runPool(
+                lambda hostname: self._runCmd(hostname, cmd), hostnames,
+                self._workers):
+            if not ordered:
+                yield (hostname, output, error)
+                continue
+            waiting[idx] = (hostname, output, error)
+            while nextIdx in waiting:
+                yield waiting.pop(nextIdx)
+                nextIdx += 1
+        return
+
+
 class serverGroup:
-    def __init__(self):
+    def __init__(self, maxConns=32, idleTimeout=300):
         config = trovitconf()
         try:
             self.__password = config.getSshRootPasswd()
         except trovitconfError:
             self.__password = getpass(("Enter root passwd "
                                        "(for error with publickey auth): "))
+        self._cache = sshConnCache(self.__password, maxConns, idleTimeout)
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, xcpType, xcpValue, traceback):
+        self.close()
+        return
+
+    def close(self):
+        """
+        Close every SSH connection kept open by the group.
+        """
+        self._cache.closeAll()
         return
 
     def sshCmd(self, hostname, cmd, sync=False):
-        with remoteServer(hostname, self.__password) as server:
-            if sync:
-                return server.sshSyncCmd(cmd)
-            else:
-                server.sshStreamCmd(cmd)
+        """
+        Execute one command on a server, reusing the connection opened by a
+        previous command if it's still alive.
+
+        Keywords:
+          @hostname (str): server to connect to
+          @cmd (str): command to execute
+          @sync (bool): return the output instead of printing it
+        Return:
+          tuple(list[stdout], list[stderr]) if sync, None otherwise
+        """
+        for retry in (True, False):
+            with self._cache.connection(hostname) as server:
+                try:
+                    if sync:
+                        return server.sshSyncCmd(cmd)
+                    return server.sshStreamCmd(cmd)
+                except sshCmdException:
+                    # The cached transport died, retry with a new login
+                    if not retry or server.isAlive():
+                        raise
+            self._cache.discard(hostname)
         return
+
+    def sshStreamGroup(self, hostnames, cmd):
+        """
+        Execute one command on many servers at the same time, printing the
+        output of all of them as it arrives, each line prefixed with the
+        server name.
+
+        Keywords:
+          @hostnames (list): servers to connect to
+          @cmd (str): command to execute
+        Return:
+          dict{str(hostname): int(exit code)}
+        """
+        mux = sshStreamMux()
+        servers = list()
+        try:
+            for hostname in hostnames:
+                try:
+                    server = self._cache.acquire(hostname)
+                except sshLoginException as sLE:
+                    print(sLE)
+                    continue
+                servers.append((hostname, server))
+                try:
+                    mux.add(server.openChannel(cmd), hostname)
+                except sshCmdException as sCE:
+                    print(sCE)
+            return mux.run()
+        finally:
+            for hostname, server in servers:
+                self._cache.release(hostname, server)
+
+    def sshParallelCmd(self, hostnames, cmd, workers=8, timeout=60,
+                       ordered=False):
+        """
+        Execute one command on many servers at the same time.
+
+        Keywords:
+          @hostnames (list): servers to connect to
+          @cmd (str): command to execute
+          @workers (int): maximum number of simultaneous connections
+          @timeout (int): connection and command timeout for each server
+          @ordered (bool): keep the hostnames order in the results
+        Return:
+          iterator[tuple(str(hostname), tuple(list[stdout], list[stderr]),
+                         Exception or None)]
+        """
+        executor = sshExecutor(self.__password, workers, timeout,
+                               self._cache)
+        return executor.run(hostnames, cmd, ordered)
+
+    def collectFacts(self, hostnames, workers=8, timeout=60, maxAge=None,
+                     cache=None):
+        """
+        Gather the facts (OS version, kernel, interfaces...) of many servers
+        running a single command on each of them. The facts collected less
+        than maxAge seconds ago are taken from the on-disk cache instead.
+
+        Keywords:
+          @hostnames (list): servers to query
+          @workers (int): maximum number of simultaneous connections
+          @timeout (int): connection and command timeout for each server
+          @maxAge (int): validity of the cached facts, by default
+                         HOST_FACTS_TTL (0 collects them all again)
+          @cache (hostFactsCache): by default the one shared by the scripts
+        Return:
+          tuple(dict{str(hostname): dict(facts)},
+                dict{str(hostname): str(error)})
+        """
+        if cache is None:
+            cache = _hostFacts
+        facts, errors = dict(), dict()
+        pending = list()
+        for hostname in hostnames:
+            record = cache.get(hostname, maxAge)
+            if record is None:
+                pending.append(hostname)
+            else:
+                facts[hostname] = record
+        for hostname, output, error in self.sshParallelCmd(pending,
+                                                           factsCommand(),
+                                                           workers, timeout):
+            if error is not None:
+                errors[hostname] = "%s" % error
+                continue
+            record = parseFacts(output[0])
+            record['hostname'] = hostname
+            record['collected'] = int(time())
+            cache.set(hostname, record)
+            facts[hostname] = record
+        cache.save()
+        return (facts, errors)
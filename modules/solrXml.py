@@ -2,53 +2,259 @@
 # -*- coding: utf-8 -*-
 
 import xml.etree.ElementTree as ET
+import httplib
+import json
+import socket
+import threading
 import urllib2
+from collections import OrderedDict
+from StringIO import StringIO
+from threadPool import runPool
+from trovitconf import trovitconf, trovitconfError
+
+
+class solrStatusException(Exception):
+    pass
 
 
 class solrXmlParser:
+    _port = 8080
+    _statusPath = '/trovit_solr/admin/cores?action=STATUS'
+    # json.nl=map returns the cores as an object instead of a flat list
+    _fmtParams = {'xml': '',
+                  'json': '&wt=json&json.nl=map'}
+    # Conversion for the typed elements of the Solr XML responses
+    _xmlTypes = {'int': int,
+                 'long': int,
+                 'float': float,
+                 'double': float,
+                 'bool': lambda x: x == 'true'}
 
-    def __init__(self):
+    def __init__(self, timeout=30, fmt=None):
+        self._timeout = timeout
+        if fmt is None:
+            try:
+                fmt = trovitconf().getSolrFormat()
+            except trovitconfError:
+                fmt = 'xml'
+        if fmt not in self._fmtParams:
+            raise solrStatusException("Unknown response format %s" % fmt)
+        self._fmt = fmt
+        # Idle keep-alive connections by server
+        self._conns = dict()
+        self._connsLock = threading.Lock()
         return
 
-    def getCores(self, xmlData):
-        """ Return a list with all core names inside a xmlData list """
-        cores = list()
-        root = ET.fromstringlist(xmlData)
-        # for each core in result (getting names)
-        map(lambda x: cores.append(x.text),
-            root.findall(".//*[@name='name']"))
-        return cores
+    def close(self):
+        """ Close the keep-alive connections """
+        with self._connsLock:
+            conns, self._conns = self._conns, dict()
+        for conn in conns.values():
+            conn.close()
+        return
 
-    def getSizes(self, xmlData):
-        """ Return a dict with all cores and its size (bytes) """
+    def _value(self, elem):
+        """ Return the text of a typed Solr element converted """
+        if elem.text is None:
+            return None
+        if elem.tag in self._xmlTypes:
+            return self._xmlTypes[elem.tag](elem.text)
+        return elem.text
+
+    def iterStatus(self, source):
+        """ Parse a cores STATUS response incrementally, yielding every core
+        as soon as its element is closed. The core fields and the fields of
+        its 'index' list are flattened into one dict.
+        Only the element of the current core is kept in memory.
+        @source: file-like object with the XML document
+        Return: iterator[tuple(str(core), dict{str(field): value})]
+        """
+        names = list()
+        status = None
+        stats = dict()
+        for event, elem in ET.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                names.append(elem.get('name'))
+                # <response><lst name="status"><lst name="core">...
+                if len(names) == 2 and names[1] == 'status':
+                    status = elem
+                continue
+            depth = len(names) - 1
+            if depth < 2 or names[1] != 'status':
+                names.pop()
+                continue
+            if depth == 2:
+                yield (stats.get('name', names[2]), stats)
+                stats = dict()
+                # Drop the parsed cores from the tree
+                status.clear()
+            elif depth in (3, 4) and elem.tag not in ('lst', 'arr'):
+                stats[names[depth]] = self._value(elem)
+            names.pop()
+        return
+
+    def iterJsonStatus(self, source):
+        """ Parse a cores STATUS response in JSON format (requested with
+        json.nl=map), yielding the same dicts as iterStatus()
+        @source: file-like object with the JSON document
+        Return: iterator[tuple(str(core), dict{str(field): value})]
+        """
+        response = json.load(source, object_pairs_hook=OrderedDict)
+        for core, fields in response.get('status', {}).items():
+            stats = dict()
+            for field, value in fields.items():
+                if isinstance(value, dict):
+                    for subField, subValue in value.items():
+                        if not isinstance(subValue, (dict, list)):
+                            stats[subField] = subValue
+                elif not isinstance(value, list):
+                    stats[field] = value
+            yield (stats.get('name', core), stats)
+        return
+
+    def parseStatus(self, xmlData):
+        """ Return an ordered dict with the stats of every core
+        @xmlData: list of lines (as returned by getXml) or file-like object
+        Return: OrderedDict{str(core): dict{str(field): value}}
+        """
+        if not hasattr(xmlData, 'read'):
+            xmlData = StringIO(''.join(xmlData))
+        return OrderedDict(self.iterStatus(xmlData))
+
+    def statusSizes(self, status):
+        """ Return a dict with all cores and its size (bytes) from the stats
+        returned by parseStatus/getStatus """
         dictCores = dict()
         dictCores['total'] = 0
-        root = ET.fromstringlist(xmlData)
-        # for each core in result (getting names)
-        for core in self.getCores(xmlData):
-            # Search core root object
-            coreRoot = root.findall((".//*[@name='sizeInBytes']/"
-                                     "..[@name='index']/"
-                                     "..[@name='%s']" % core))
-            # Search sizeInBytes in the core object
-            findSize = coreRoot[0].findall(".//*[@name='sizeInBytes']")
-            # format to int
-            coresize = int(findSize[0].text)
+        for core, stats in status.items():
+            coresize = int(stats.get('sizeInBytes', 0))
             dictCores[core] = coresize
             dictCores['total'] += coresize
         return dictCores
 
+    def getCores(self, xmlData):
+        """ Return a list with all core names inside a xmlData list """
+        return self.parseStatus(xmlData).keys()
+
+    def getSizes(self, xmlData):
+        """ Return a dict with all cores and its size (bytes) """
+        return self.statusSizes(self.parseStatus(xmlData))
+
+    def _statusUrl(self, srvname):
+        return "http://%s:%s%s" % (srvname, self._port, self._statusPath)
+
+    def _formatOf(self, fmt):
+        if fmt is None:
+            return self._fmt
+        if fmt not in self._fmtParams:
+            raise solrStatusException("Unknown response format %s" % fmt)
+        return fmt
+
+    def _request(self, srvname, path):
+        """ Send a GET request reusing the idle keep-alive connection to
+        srvname if there is one
+        Return: tuple(httplib.HTTPConnection, httplib.HTTPResponse)
+        """
+        with self._connsLock:
+            conn = self._conns.pop(srvname, None)
+        for retry in (conn is not None, False):
+            if conn is None:
+                conn = httplib.HTTPConnection(srvname, self._port,
+                                              timeout=self._timeout)
+            try:
+                conn.request('GET', path)
+                return (conn, conn.getresponse())
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                conn = None
+                # The server may have closed an idle connection
+                if not retry:
+                    raise
+
+    def _release(self, srvname, conn, response):
+        """ Keep the connection for the next request to srvname if the
+        server allows it """
+        response.read()
+        if response.will_close:
+            conn.close()
+            return
+        with self._connsLock:
+            if srvname in self._conns:
+                self._conns[srvname].close()
+            self._conns[srvname] = conn
+        return
+
+    def fetchStatus(self, srvname, fmt=None):
+        """ Retrieve the stats of every core of a server through a keep-alive
+        connection, parsing the HTTP response while it's read
+        @fmt: response format [xml|json], by default the configured one
+        Return: OrderedDict{str(core): dict{str(field): value}}
+        """
+        fmt = self._formatOf(fmt)
+        try:
+            conn, response = self._request(srvname, self._statusPath +
+                                           self._fmtParams[fmt])
+        except (httplib.HTTPException, socket.error) as err:
+            raise solrStatusException("%s" % err)
+        try:
+            if response.status != 200:
+                raise solrStatusException("%s: %s" % (response.status,
+                                                      response.reason))
+            if fmt == 'json':
+                status = OrderedDict(self.iterJsonStatus(response))
+            else:
+                status = OrderedDict(self.iterStatus(response))
+        except (ET.ParseError, ValueError, httplib.HTTPException,
+                socket.error) as err:
+            conn.close()
+            raise solrStatusException("%s" % err)
+        except solrStatusException:
+            conn.close()
+            raise
+        self._release(srvname, conn, response)
+        return status
+
+    def getStatus(self, srvname, fmt=None):
+        """ Retrieve the stats of every core of a server, printing the error
+        (and returning no cores) if the request fails
+        @fmt: response format [xml|json], by default the configured one
+        Return: OrderedDict{str(core): dict{str(field): value}}
+        """
+        try:
+            return self.fetchStatus(srvname, fmt)
+        except solrStatusException as sse:
+            print("Error getting STATUS from %s (%s)" % (srvname, sse))
+        return OrderedDict()
+
+    def collectStatus(self, servers, workers=8, fmt=None):
+        """ Retrieve the STATUS of many servers at the same time
+        @servers: list of server names
+        @workers: maximum number of simultaneous requests
+        @fmt: response format [xml|json], by default the configured one
+        Return: tuple(dict{str(server): OrderedDict(core stats)},
+                      dict{str(server): str(error)})
+        """
+        statuses, errors = dict(), dict()
+        fmt = self._formatOf(fmt)
+        for idx, srvname, status, error in runPool(
+                lambda srvname: self.fetchStatus(srvname, fmt), servers,
+                workers):
+            if error is None:
+                statuses[srvname] = status
+            else:
+                errors[srvname] = "%s" % error
+        return (statuses, errors)
+
     def getXml(self, srvname):
         """ Retrieve XML information through an HTTP request """
-        url = ("http://%s:8080/"
-               "trovit_solr/admin/cores?action=STATUS" % srvname)
+        xmlInfo = list()
         try:
-            httpReq = urllib2.urlopen(url)
+            httpReq = urllib2.urlopen(self._statusUrl(srvname),
+                                      timeout=self._timeout)
         except urllib2.HTTPError as h:
             print("Error getting STATUS from %s (%s: %s)" %
                   (srvname, h.code, h.reason))
         else:
             xmlInfo = httpReq.readlines()
-        finally:
             httpReq.close()
         return xmlInfo
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Pool of worker threads shared by the modules that talk to many servers
+at the same time (SSH commands, Solr STATUS requests)."""
+
+import threading
+from Queue import Queue, Empty
+
+
+def _worker(func, tasks, results):
+    """
+    Take items from the tasks queue until it's empty, calling func on each
+    of them.
+    Keywords:
+        @func: (callable) function called with every item
+        @tasks: (Queue) tuple(int(index), item) items
+        @results: (Queue) tuple(index, item, result, error) items
+    Return: None
+    """
+    while True:
+        try:
+            idx, item = tasks.get_nowait()
+        except Empty:
+            return
+        try:
+            results.put((idx, item, func(item), None))
+        except Exception as e:
+            results.put((idx, item, None, e))
+
+
+def runPool(func, items, workers=8):
+    """
+    Call func on every item using up to workers threads, yielding the
+    results in completion order. Errors raised by func are returned
+    instead of stopping the pool.
+    Keywords:
+        @func: (callable) function called with every item
+        @items: (list) arguments of func
+        @workers: (int) maximum number of simultaneous calls
+    Return: iterator[tuple(int(index of item), item, result,
+                           Exception or None)]
+    """
+    tasks, results = Queue(), Queue()
+    for task in enumerate(items):
+        tasks.put(task)
+    pending = tasks.qsize()
+    for i in xrange(0, min(workers, pending)):
+        worker = threading.Thread(target=_worker,
+                                  args=(func, tasks, results))
+        worker.daemon = True
+        worker.start()
+    while pending > 0:
+        try:
+            # A timeout keeps the main thread responsive to Ctrl-C
+            result = results.get(True, 1.0)
+        except Empty:
+            continue
+        pending -= 1
+        yield result
+    return
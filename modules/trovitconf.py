@@ -46,3 +46,14 @@ class trovitconf:
         except ConfigParser.NoSectionError:
             raise trovitconfError("No configuration section for SSH")
         return passwd
+
+    def getSolrFormat(self):
+        """ Retrieve the response format (xml or json) used for the Solr
+            admin requests
+            Return a String with the format name
+        """
+        try:
+            fmt = self.conf.get('solr', 'format')
+        except (ConfigParser.NoSectionError, ConfigParser.NoOptionError):
+            raise trovitconfError("No response format configured for Solr")
+        return fmt
@@ -5,12 +5,20 @@
 the Trovit Platform
 """
 
-__all__ = ['gbl', 'racktables', 'trovitdb']
+__all__ = ['attributes', 'dictionary', 'gbl', 'inventory', 'ipam',
+           'mirror', 'racktables', 'reconcile', 'tags', 'target',
+           'trovitdb']
 __version__ = '0.1'
 
 
+import atexit
+import threading
+from contextlib import contextmanager
+from itertools import groupby
+from time import time
 from getpass import getpass
 from trovitconf import trovitconf, trovitconfError
+from trovitstats import stats
 
 try:
     import mysql.connector as mdb
@@ -19,15 +27,279 @@ except ImportError as ie:
     raise
 
 
+# MySQL client errors meaning the server side of the connection is gone
+# (server has gone away, lost connection during query, session lost)
+_lostCnxErrors = (2006, 2013, 2055)
+# Pool settings, they can be overridden in each configuration section
+_poolDefaults = {'pool_size': 4,
+                 'pool_idle_timeout': 300,
+                 'pool_timeout': 30}
+_pools = dict()
+_configCache = dict()
+_poolsLock = threading.Lock()
+
+
 class trovitdbException(Exception):
     pass
 
 
+class trovitdbPool:
+    """Process-wide pool of MySQL connections for one configuration section.
+    Idle connections are health-checked on checkout and reopened when MySQL
+    dropped them.
+    """
+
+    def __init__(self, config, maxSize=4, idleTimeout=300, timeout=30):
+        self._config = config
+        self._maxSize = maxSize
+        self._idleTimeout = idleTimeout
+        self._timeout = timeout
+        self._idle = list()
+        self._busy = 0
+        self._lock = threading.Condition()
+        return
+
+    def _healthy(self, cnx):
+        """ Check the connection with a ping, reconnecting if it's needed
+        Return: boolean
+        """
+        try:
+            cnx.ping(reconnect=True, attempts=2, delay=0)
+        except mdb.Error:
+            return False
+        return True
+
+    def checkout(self):
+        """ Take a connection from the pool, waiting if all of them are busy
+        (up to the pool timeout, usually a sign of objects never closed)
+        Return: mysql.connector connection
+        """
+        cnx, lastUse = None, 0
+        deadline = time() + self._timeout
+        with self._lock:
+            while len(self._idle) == 0 and self._busy >= self._maxSize:
+                remaining = deadline - time()
+                if remaining <= 0:
+                    raise trovitdbException("No free connection in the pool "
+                                            "after %ss (%s in use), are "
+                                            "the trovitdb objects closed?"
+                                            % (self._timeout, self._busy))
+                self._lock.wait(remaining)
+            if len(self._idle) > 0:
+                cnx, lastUse = self._idle.pop()
+            self._busy += 1
+        try:
+            if cnx is not None and time() - lastUse > self._idleTimeout:
+                self._close(cnx)
+                cnx = None
+            if cnx is not None and not self._healthy(cnx):
+                self._close(cnx)
+                cnx = None
+            if cnx is None:
+                cnx = mdb.connect(**self._config)
+        except:
+            self._release()
+            raise
+        return cnx
+
+    def checkin(self, cnx):
+        """ Give back a connection to the pool, undoing any transaction left
+        open
+        Return: None
+        """
+        try:
+            if cnx.in_transaction:
+                cnx.rollback()
+        except mdb.Error:
+            self.discard(cnx)
+            return
+        with self._lock:
+            self._busy -= 1
+            self._idle.append((cnx, time()))
+            self._lock.notify()
+        return
+
+    def discard(self, cnx):
+        """ Close a broken connection and free its slot in the pool
+        Return: None
+        """
+        self._close(cnx)
+        self._release()
+        return
+
+    def closeAll(self):
+        """ Close all the idle connections
+        Return: None
+        """
+        with self._lock:
+            idle, self._idle = self._idle, list()
+        for cnx, lastUse in idle:
+            self._close(cnx)
+        return
+
+    def _release(self):
+        with self._lock:
+            self._busy -= 1
+            self._lock.notify()
+        return
+
+    def _close(self, cnx):
+        try:
+            cnx.close()
+        except mdb.Error:
+            pass
+        return
+
+
+def getPool(section, config):
+    """ Return the connection pool for a configuration section, creating it
+    the first time
+    Keywords:
+        @section: (str) configuration section name
+        @config: (dict) connection and pool parameters
+    Return: trovitdbPool
+    """
+    with _poolsLock:
+        if section not in _pools:
+            cnxConfig = config.copy()
+            # Statements out of a transaction() scope don't need a COMMIT
+            cnxConfig['autocommit'] = True
+            poolConfig = dict()
+            for key, value in _poolDefaults.items():
+                poolConfig[key] = int(cnxConfig.pop(key, value))
+            _pools[section] = trovitdbPool(cnxConfig,
+                                           poolConfig['pool_size'],
+                                           poolConfig['pool_idle_timeout'],
+                                           poolConfig['pool_timeout'])
+        return _pools[section]
+
+
+@atexit.register
+def closePools():
+    """ Close every pooled connection (called at exit) """
+    with _poolsLock:
+        for pool in _pools.values():
+            pool.closeAll()
+    return
+
+
+class trovitdbBatch:
+    """Queue of write statements sent with executemany in chunks inside a
+    single transaction. Used through trovitdb.batch():
+
+        with rt.batch(chunkSize=200) as writer:
+            rt.allocateIp(...)
+        print(writer.failures)
+    """
+
+    def __init__(self, db, chunkSize=500, flushOnError=False):
+        self._db = db
+        self._chunkSize = chunkSize
+        self._flushOnError = flushOnError
+        self._queue = list()
+        self.failures = list()
+        return
+
+    def __enter__(self):
+        self._db._batch = self
+        return self
+
+    def __exit__(self, xcpType, xcpValue, traceback):
+        self._db._batch = None
+        if xcpType is None:
+            self.flush()
+        elif self._flushOnError:
+            # Send the statements queued before the exception (or Ctrl-C),
+            # without hiding it if the flush fails too
+            try:
+                self.flush()
+            except trovitdbException as tE:
+                print('%s %s' % (self._db._errorMsg, tE))
+        elif len(self._queue) > 0:
+            self._queue = list()
+            self._db._writesDiscarded()
+        return
+
+    def __len__(self):
+        return len(self._queue)
+
+    def add(self, sqlStmt, params):
+        """ Queue a write statement
+        Keywords:
+            @sqlStmt: (str) SQL statement with %s placeholders
+            @params: (tuple) Values bound to the statement placeholders
+        Return: None
+        """
+        self._queue.append((sqlStmt, params))
+        return
+
+    def flush(self):
+        """ Send every queued statement and commit them all at once.
+        Consecutive rows of the same statement are grouped and sent with
+        executemany. Rows rejected by MySQL are rolled back alone and
+        reported, the rest of the batch is committed.
+        Return: list[tuple(str(sqlStmt), tuple(params), str(error)), ...]
+        """
+        queue, self._queue = self._queue, list()
+        failures = list()
+        cursor = self._db._cnx.cursor()
+        try:
+            with self._db.transaction():
+                for sqlStmt, rows in groupby(queue, lambda x: x[0]):
+                    rows = [row[1] for row in rows]
+                    for idx in xrange(0, len(rows), self._chunkSize):
+                        chunk = rows[idx:idx + self._chunkSize]
+                        error = self._execute(cursor, sqlStmt, chunk, True)
+                        if error is not True:
+                            for params in chunk:
+                                error = self._execute(cursor, sqlStmt, params)
+                                if error is not True:
+                                    failures.append((sqlStmt, params, error))
+        except mdb.Error as err:
+            raise trovitdbException("[mysql-connector (#%s)] %s"
+                                    % (err.errno, err.msg))
+        finally:
+            cursor.close()
+        if len(failures) > 0:
+            self._db._writesDiscarded()
+        self.failures.extend(failures)
+        return failures
+
+    def _execute(self, cursor, sqlStmt, params, many=False):
+        """ Run a statement protected by a savepoint, undoing it on error
+        Return: True or str(error)
+        """
+        cursor.execute('SAVEPOINT trovitdb_batch')
+        started = stats.start()
+        try:
+            if many:
+                cursor.executemany(sqlStmt, params)
+            else:
+                cursor.execute(sqlStmt, params)
+            stats.sql(sqlStmt, started, len(params) if many else 1)
+        except mdb.Error as err:
+            if err.errno in _lostCnxErrors:
+                raise
+            cursor.execute('ROLLBACK TO SAVEPOINT trovitdb_batch')
+            return str(err)
+        cursor.execute('RELEASE SAVEPOINT trovitdb_batch')
+        return True
+
+
 class trovitdb:
     _confSection = ''
+    _fetchSize = 1000
+    _batchSize = 500
 
-    def __init__(self):
+    def __init__(self, readOnly=False, mirror=None):
         self._cnx = None
+        self._pool = None
+        self._batch = None
+        # Path of a local SQLite mirror used instead of MySQL (read-only)
+        self._mirror = mirror
+        self._readOnly = readOnly or mirror is not None
+        self._txDepth = 0
+        self._prepared = dict()
         self._errorMsg = '[trovitDB]: '
         self.catchExcpts = ['trovitconfError',
                             'trovitdbException']
@@ -37,8 +309,7 @@ class trovitdb:
         return self
 
     def __exit__(self, xcpType, xcpValue, traceback):
-        if self._cnx is not None:
-            self._cnx.close()
+        self.close()
         if xcpType is not None:
             if xcpType.__name__ in self.catchExcpts:
                 print("[%s]: %s" % (xcpType.__name__, xcpValue))
@@ -46,22 +317,57 @@ class trovitdb:
         return
 
     def connect(self):
-        """ Do the connection to the MySQL database
+        """ Take a connection to the MySQL database from the process pool,
+        or open the local mirror if the object was created with one
         Return: None
         """
+        if self._mirror is not None:
+            from .mirror import mirrorConnection
+            self._pool = None
+            self._cnx = mirrorConnection(self._mirror)
+            return
         try:
-            self._cnx = mdb.connect(**self.getConfig())
+            self._pool = getPool(self._confSection, self.getConfig())
+            self._cnx = self._pool.checkout()
         except mdb.Error as err:
             raise trovitdbException("[mysql-connector (#%s)] %s"
                                     % (err.errno, err.msg))
         return
 
+    def close(self):
+        """ Give back the connection to the pool
+        Return: None
+        """
+        if self._cnx is not None:
+            self._closePrepared()
+            if self._pool is not None:
+                self._pool.checkin(self._cnx)
+            else:
+                self._cnx.close()
+            self._cnx = None
+        return
+
+    def _closePrepared(self):
+        """ Release the prepared statements cached for this connection
+        Return: None
+        """
+        for cursor in self._prepared.values():
+            try:
+                cursor.close()
+            except mdb.Error:
+                pass
+        self._prepared = dict()
+        return
+
     def getConfig(self):
         """ Retrieve the configuration values for the DB connection from the
-        configuration file
+        configuration file. Values are cached per section, so the password
+        is only asked once per process.
         Return: dict{str(key): str(value), ...}
         """
         DB = {}
+        if self._confSection in _configCache:
+            return _configCache[self._confSection].copy()
         try:
             config = trovitconf()
             DB.update(config.getConfig(self._confSection))
@@ -70,22 +376,214 @@ class trovitdb:
         if DB['password'] == '':
             DB['password'] = getpass('Enter MySQL password for %s@%s: ' %
                                      (DB['user'], DB['host']))
-        return DB
+        _configCache[self._confSection] = DB
+        return DB.copy()
+
+    def _reconnect(self):
+        """ Reopen the current connection after MySQL dropped it
+        Return: None
+        """
+        self._prepared = dict()
+        try:
+            self._cnx.reconnect(attempts=3, delay=1)
+        except mdb.Error as err:
+            self._pool.discard(self._cnx)
+            self._cnx = None
+            raise trovitdbException("[mysql-connector (#%s)] %s"
+                                    % (err.errno, err.msg))
+        return
 
-    def query(self, sqlStmt, op='select'):
-        """ Send a sql statement to the MySQL database
+    @contextmanager
+    def transaction(self):
+        """ Group the statements sent inside the with block in a single
+        transaction, committed at the end or rolled back if an exception is
+        raised. Nested scopes join the outermost one. Read-only objects
+        never send a COMMIT, their transactions are always rolled back.
+            with rt.transaction():
+                rt.allocateIp(...)
+        Return: context manager
+        """
+        try:
+            if self._txDepth == 0:
+                if self._readOnly:
+                    self._cnx.start_transaction(readonly=True)
+                else:
+                    self._cnx.start_transaction()
+            self._txDepth += 1
+        except mdb.Error as err:
+            raise trovitdbException("[mysql-connector (#%s)] %s"
+                                    % (err.errno, err.msg))
+        try:
+            yield self
+        except:
+            self._txDepth -= 1
+            if self._txDepth == 0:
+                self._cnx.rollback()
+                if not self._readOnly:
+                    self._writesDiscarded()
+            raise
+        self._txDepth -= 1
+        if self._txDepth == 0:
+            try:
+                if self._readOnly:
+                    self._cnx.rollback()
+                else:
+                    self._cnx.commit()
+            except mdb.Error as err:
+                raise trovitdbException("[mysql-connector (#%s)] %s"
+                                        % (err.errno, err.msg))
+
+    def _writesDiscarded(self):
+        """ Called when writes already sent or queued are undone (rolled
+        back transaction, rows rejected or batch dropped). Subclasses
+        forget here the state updated along with those writes.
+        Return: None
+        """
+        return
+
+    def query(self, sqlStmt, op='select', params=None):
+        """ Send a sql statement to the MySQL database. The connection works
+        in autocommit mode, use transaction() to group several writes.
+        Errors of writes and of any statement inside a transaction raise
+        trovitdbException (so the transaction is rolled back); errors of
+        the other selects are printed and an empty result returned.
+        Keywords:
+            @sqlStmt: (str) SQL statement, with %s placeholders if params
+                      are given
+            @op: (str) One of [select|insert|update]
+            @params: (tuple) Values bound to the statement placeholders
         Return: list[tuple(field1, field2, ...), ...]
         """
         data = ''
+        if op != 'select' and self._readOnly:
+            raise trovitdbException("Write requested on a read-only "
+                                    "connection")
+        for retry in (True, False):
+            try:
+                started = stats.start()
+                cursor = self._cnx.cursor()
+                cursor.execute(sqlStmt, params)
+                if op == 'select':
+                    # data = map(lambda x: str(x[0]), cursor.fetchall())
+                    data = cursor.fetchall()
+                    stats.sql(sqlStmt, started, len(data))
+                else:
+                    stats.sql(sqlStmt, started, max(cursor.rowcount, 0))
+                cursor.close()
+            except mdb.Error as err:
+                if retry and err.errno in _lostCnxErrors \
+                   and self._txDepth == 0:
+                    self._reconnect()
+                    continue
+                if op != 'select' or self._txDepth > 0:
+                    raise trovitdbException("[mysql-connector (#%s)] %s"
+                                            % (err.errno, err.msg))
+                print('%s Error retrieving data from db' % self._errorMsg)
+                print('%s %s' % (self._errorMsg, err))
+            break
+        return data
+
+    def batch(self, chunkSize=None, flushOnError=False):
+        """ Return a batch writer. While it's active (with statement) the
+        write methods queue their statements instead of sending them
+        Keywords:
+            @chunkSize: (int) Rows per executemany call
+            @flushOnError: (bool) Send the queued statements even if the
+                           with block is left by an exception
+        Return: trovitdbBatch
+        """
+        if chunkSize is None:
+            chunkSize = self._batchSize
+        return trovitdbBatch(self, chunkSize, flushOnError)
+
+    def write(self, sqlStmt, params, op='insert'):
+        """ Send a write statement, or queue it if a batch is active
+        Keywords:
+            @sqlStmt: (str) SQL statement with %s placeholders
+            @params: (tuple) Values bound to the statement placeholders
+            @op: (str) One of [insert|update]
+        Return: None
+        """
+        if self._readOnly:
+            raise trovitdbException("Write requested on a read-only "
+                                    "connection")
+        if self._batch is not None:
+            self._batch.add(sqlStmt, params)
+        else:
+            self.query(sqlStmt, op, params)
+        return
+
+    def iterQuery(self, sqlStmt, params=None, batchSize=None, prepared=False):
+        """ Send a select statement and iterate over the results, fetching
+        them from the server in batches through an unbuffered cursor. The
+        whole result must be consumed (or the iterator closed) before
+        sending another statement through the same object. Inside a
+        transaction errors raise trovitdbException, out of it they are
+        printed and the iteration stops.
+        Keywords:
+            @sqlStmt: (str) SQL statement with %s placeholders
+            @params: (tuple) Values bound to the statement placeholders
+            @batchSize: (int) Rows fetched per round trip
+            @prepared: (bool) Use a server side prepared statement, reused
+                       in the next calls with the same sqlStmt
+        Return: iterator[tuple(field1, field2, ...)]
+        """
+        if batchSize is None:
+            batchSize = self._fetchSize
+        for retry in (True, False):
+            try:
+                started = stats.start()
+                cursor = self._getCursor(sqlStmt, prepared)
+                cursor.execute(sqlStmt, params)
+                rows = cursor.fetchmany(batchSize)
+                # The latency is measured until the first batch arrives, the
+                # rest depends on how fast the caller consumes the rows
+                elapsed = stats.elapsed(started)
+            except mdb.Error as err:
+                if retry and err.errno in _lostCnxErrors \
+                   and self._txDepth == 0:
+                    self._reconnect()
+                    continue
+                if self._txDepth > 0:
+                    raise trovitdbException("[mysql-connector (#%s)] %s"
+                                            % (err.errno, err.msg))
+                print('%s Error retrieving data from db' % self._errorMsg)
+                print('%s %s' % (self._errorMsg, err))
+                return
+            break
+        count = 0
         try:
-            cursor = self._cnx.cursor()
-            cursor.execute(sqlStmt)
-            if op == 'select':
-                # data = map(lambda x: str(x[0]), cursor.fetchall())
-                data = cursor.fetchall()
-            self._cnx.commit()
-            cursor.close()
+            while len(rows) > 0:
+                count += len(rows)
+                for row in rows:
+                    yield row
+                rows = cursor.fetchmany(batchSize)
         except mdb.Error as err:
+            if self._txDepth > 0:
+                raise trovitdbException("[mysql-connector (#%s)] %s"
+                                        % (err.errno, err.msg))
             print('%s Error retrieving data from db' % self._errorMsg)
             print('%s %s' % (self._errorMsg, err))
-        return data
+        finally:
+            # Drain whatever the caller left unread, the connection can't be
+            # used again until the result set is consumed
+            try:
+                while len(cursor.fetchmany(batchSize)) > 0:
+                    pass
+            except mdb.Error:
+                pass
+            if not prepared:
+                cursor.close()
+            stats.sql(sqlStmt, started, count, elapsed)
+        return
+
+    def _getCursor(self, sqlStmt, prepared=False):
+        """ Return an unbuffered cursor, reusing the prepared one already
+        created for sqlStmt
+        Return: mysql.connector cursor
+        """
+        if not prepared:
+            return self._cnx.cursor(buffered=False)
+        if sqlStmt not in self._prepared:
+            self._prepared[sqlStmt] = self._cnx.cursor(prepared=True)
+        return self._prepared[sqlStmt]
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Attribute values of many Racktables objects kept in a compact
+object x attribute matrix"""
+
+_missing = object()
+_stale = object()
+
+
+class attributeMatrix:
+    """
+    Values of a set of attributes for a set of objects, stored in a flat
+    list (one row per object, one column per attribute). Every cell keeps
+    the decoded value (dictionary values already translated) and the raw
+    uint_value of the AttributeValue row.
+    """
+
+    def __init__(self, objectIds, attrIds):
+        self.objectIds = list(objectIds)
+        self.attrIds = list(attrIds)
+        self._objIdx = dict((objId, idx)
+                            for idx, objId in enumerate(self.objectIds))
+        self._attrIdx = dict((attrId, idx)
+                             for idx, attrId in enumerate(self.attrIds))
+        # Racktables type of every attribute found [string|uint|float|...]
+        self.attrTypes = dict()
+        size = len(self.objectIds) * len(self.attrIds)
+        self._values = [_missing] * size
+        self._raw = [_missing] * size
+        return
+
+    def _cell(self, objId, attrId):
+        """ Return the position of a cell, or -1 if it's out of the matrix """
+        if objId not in self._objIdx or attrId not in self._attrIdx:
+            return -1
+        return self._objIdx[objId] * len(self.attrIds) + \
+            self._attrIdx[attrId]
+
+    def covers(self, objId, attrId):
+        """
+        Check if the matrix was loaded for this object and attribute and
+        it hasn't been invalidated
+        Return: boolean
+        """
+        cell = self._cell(objId, attrId)
+        return cell >= 0 and self._values[cell] is not _stale
+
+    def invalidate(self, objId, attrId):
+        """
+        Mark a cell as outdated after a change made in the DB, so it has to
+        be read again from MySQL
+        Return: None
+        """
+        cell = self._cell(objId, attrId)
+        if cell >= 0:
+            self._values[cell] = _stale
+            self._raw[cell] = _stale
+        return
+
+    def set(self, objId, attrId, value, raw=None, attrType=None):
+        """
+        Store the value of an attribute
+        Keywords:
+            @objId: (int) Object ID
+            @attrId: (int) Attribute ID
+            @value: decoded value
+            @raw: (int) uint_value of the attribute
+            @attrType: (str) Racktables type of the attribute
+        Return: None
+        """
+        cell = self._cell(objId, attrId)
+        if cell >= 0:
+            self._values[cell] = value
+            self._raw[cell] = raw
+            if attrType is not None:
+                self.attrTypes[attrId] = attrType
+        return
+
+    def has(self, objId, attrId):
+        """
+        Check if the object has a value for the attribute
+        Return: boolean
+        """
+        cell = self._cell(objId, attrId)
+        return cell >= 0 and self._values[cell] not in (_missing, _stale)
+
+    def get(self, objId, attrId, default=None):
+        """
+        Return the decoded value of an attribute
+        """
+        cell = self._cell(objId, attrId)
+        if cell < 0 or self._values[cell] in (_missing, _stale):
+            return default
+        return self._values[cell]
+
+    def raw(self, objId, attrId, default=None):
+        """
+        Return the uint_value stored for an attribute
+        """
+        cell = self._cell(objId, attrId)
+        if cell < 0 or self._raw[cell] in (_missing, _stale):
+            return default
+        return self._raw[cell]
+
+    def row(self, objId):
+        """
+        Return the decoded values of an object
+        Return: dict{int(attrId): value}
+        """
+        return dict((attrId, self.get(objId, attrId))
+                    for attrId in self.attrIds if self.has(objId, attrId))
+
+    def column(self, attrId):
+        """
+        Return the decoded values of an attribute for every object
+        Return: dict{int(objId): value}
+        """
+        return dict((objId, self.get(objId, attrId))
+                    for objId in self.objectIds if self.has(objId, attrId))
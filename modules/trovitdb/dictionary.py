@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Cache of the Racktables dictionary (Dictionary and AttributeMap tables)
+shared by all the racktables objects of the process"""
+
+from time import time
+
+
+class dictCache:
+    """
+    Dictionary values indexed by chapter in both directions
+    (key -> value and value -> key) and the chapter used by every
+    attribute of every object type, so attribute values can be decoded
+    without joining Dictionary and AttributeMap.
+    """
+
+    def __init__(self, rt, ttl=300):
+        self._ttl = ttl
+        self._loaded = 0
+        self._values = dict()
+        self._keys = dict()
+        self._chapters = dict()
+        self.load(rt)
+        return
+
+    def load(self, rt):
+        """
+        (Re)load the dictionary and the attribute map from Racktables DB
+        Keywords:
+            @rt: (racktables) connected racktables object
+        Return: None
+        """
+        values, keys = dict(), dict()
+        for chapterId, dictKey, dictValue in rt.iterQuery(
+                "select chapter_id, dict_key, dict_value from Dictionary;"):
+            values[dictKey] = (chapterId, dictValue)
+            keys.setdefault(chapterId, dict())[dictValue] = dictKey
+        chapters = dict()
+        for objType, attrId, chapterId in rt.iterQuery(
+                "select objtype_id, attr_id, chapter_id from AttributeMap \
+                 where chapter_id is not null;"):
+            chapters[(objType, attrId)] = chapterId
+        self._values, self._keys = values, keys
+        self._chapters = chapters
+        self._loaded = time()
+        return
+
+    def isExpired(self):
+        """
+        Check if the cache is older than its TTL
+        Return: boolean
+        """
+        return self._loaded == 0 or time() - self._loaded > self._ttl
+
+    def invalidate(self):
+        """ Force a reload the next time the cache is requested """
+        self._loaded = 0
+        return
+
+    def getChapter(self, objType, attrId):
+        """
+        Get the dictionary chapter of an attribute for an object type
+        Return: int(chapterId) or None if it isn't a dictionary attribute
+        """
+        return self._chapters.get((objType, attrId))
+
+    def getValue(self, dictKey, chapterId=None):
+        """
+        Get the value of a dictionary key
+        Keywords:
+            @dictKey: (int) dict_key
+            @chapterId: (int) chapter expected, None for any
+        Return: str(value) or None
+        """
+        entry = self._values.get(dictKey)
+        if entry is None or (chapterId is not None and
+                             entry[0] != chapterId):
+            return None
+        return entry[1]
+
+    def getKey(self, chapterId, value):
+        """
+        Get the key of a value in a chapter
+        Return: int(dict_key) or None
+        """
+        return self._keys.get(chapterId, dict()).get(value)
+
+    def getChapterValues(self, chapterId):
+        """
+        Get all the values of a chapter
+        Return: dict{str(value): int(dict_key)}
+        """
+        return dict(self._keys.get(chapterId, dict()))
@@ -31,7 +31,49 @@ class trovitGlobal(trovitdb):
         @dKey: str(core|server) set the key for the dict
         Return: dict{'key': list(server1|core1, server2|core2, ...), ...}
         """
-        dictCores = {}
+        topology = self.getTopology()
+        if dKey == 'server':
+            index = topology.serverCores
+        else:
+            index = topology.coreServers
+        return dict((key, list(values)) for key, values in index.items())
+
+    def getTopology(self, refresh=False):
+        """
+        Return the cores topology shared by all the trovitGlobal objects of
+        the process, loading it the first time
+        @refresh: bool reload the assignments from the DB, applying only the
+                  changes
+        Return: coreTopology
+        """
+        global _topology
+        if _topology is None:
+            _topology = coreTopology()
+            refresh = True
+        if refresh:
+            _topology.update(self._coreAssignments())
+        return _topology
+
+    def _coreName(self, country, vertical, scriptType):
+        """
+        Build the core name from its country, vertical and type
+        Return: str(core name)
+        """
+        corename = '%s_%s_%s' % (self._typeMaps[scriptType],
+                                 self._verticalMaps[vertical],
+                                 country)
+        if country in ('gf', 'gg'):
+            corename = corename[:-3]
+        if country == 'xw':
+            corename = self._typeMaps[scriptType]
+        return corename
+
+    def _coreAssignments(self):
+        """
+        Retrieve the active cores of every server
+        Return: set(tuple(server, core, country, vertical, type), ...)
+        """
+        assignments = set()
         cores = self.query("SELECT s_server, \
                                    fk_c_id_tbl_countries, \
                                    fk_i_id_tbl_vertical, \
@@ -43,21 +85,108 @@ class trovitGlobal(trovitdb):
                                   AND tbl_lucene_servers.i_active = 1 \
                                   AND tbl_solr_server_index.i_active = 1")
         for core in cores:
-            corename = '%s_%s_%s' % (self._typeMaps[core[3]],
-                                     self._verticalMaps[core[2]],
-                                     core[1])
-            if core[1] in ('gf', 'gg'):
-                corename = corename[:-3]
-            if core[1] == 'xw':
-                corename = self._typeMaps[core[3]]
-            if dKey == 'server':
-                key = core[0]
-                value = corename
-            else:
-                key = corename
-                value = core[0]
-            if key in dictCores:
-                dictCores[key].append(value)
-            else:
-                dictCores[key] = [value]
-        return dictCores
+            assignments.add((core[0],
+                             self._coreName(core[1], core[2], core[3]),
+                             core[1],
+                             self._verticalMaps[core[2]],
+                             self._typeMaps[core[3]]))
+        return assignments
+
+
+_topology = None
+
+
+class coreTopology:
+    """
+    Solr cores assigned to each server, indexed by core and by server and
+    with secondary indexes of the cores by country, vertical and type.
+    All the lookups return sets.
+    """
+
+    def __init__(self):
+        self._assignments = set()
+        self.coreServers = dict()
+        self.serverCores = dict()
+        self.byCountry = dict()
+        self.byVertical = dict()
+        self.byType = dict()
+        # Assignments behind every (index, key, core) entry of the
+        # secondary indexes: the same core name may be used by servers of
+        # different countries, verticals or types
+        self._refs = dict()
+        return
+
+    def update(self, assignments):
+        """
+        Apply a new set of assignments, touching only the ones that changed
+        @assignments: set(tuple(server, core, country, vertical, type), ...)
+        Return: tuple(set(added assignments), set(removed assignments))
+        """
+        added = assignments - self._assignments
+        removed = self._assignments - assignments
+        for server, core, country, vertical, scriptType in removed:
+            self._discard(self.coreServers, core, server)
+            self._discard(self.serverCores, server, core)
+            self._unlink(self.byCountry, country, core)
+            self._unlink(self.byVertical, vertical, core)
+            self._unlink(self.byType, scriptType, core)
+        for server, core, country, vertical, scriptType in added:
+            self.coreServers.setdefault(core, set()).add(server)
+            self.serverCores.setdefault(server, set()).add(core)
+            self._link(self.byCountry, country, core)
+            self._link(self.byVertical, vertical, core)
+            self._link(self.byType, scriptType, core)
+        self._assignments = set(assignments)
+        return (added, removed)
+
+    def _link(self, index, key, core):
+        """ Add a core to a secondary index, counting its assignments """
+        ref = (id(index), key, core)
+        self._refs[ref] = self._refs.get(ref, 0) + 1
+        index.setdefault(key, set()).add(core)
+        return
+
+    def _unlink(self, index, key, core):
+        """ Remove a core from a secondary index with its last assignment """
+        ref = (id(index), key, core)
+        self._refs[ref] = self._refs.get(ref, 1) - 1
+        if self._refs[ref] <= 0:
+            del self._refs[ref]
+            self._discard(index, key, core)
+        return
+
+    def _discard(self, index, key, value):
+        if key in index:
+            index[key].discard(value)
+            if len(index[key]) == 0:
+                del index[key]
+        return
+
+    def servers(self, core):
+        """ Return the servers with a core """
+        return self.coreServers.get(core, set())
+
+    def cores(self, server=None, country=None, vertical=None,
+              scriptType=None):
+        """
+        Return the cores matching all the filters given (all the cores
+        without filters)
+        @server: str server name
+        @country: str country code
+        @vertical: str vertical name (homes, cars, ...)
+        @scriptType: str type name (search, kw, ...)
+        Return: set(core, ...)
+        """
+        filters = [(self.serverCores, server),
+                   (self.byCountry, country),
+                   (self.byVertical, vertical),
+                   (self.byType, scriptType)]
+        result = None
+        for index, key in filters:
+            if key is None:
+                continue
+            values = index.get(key, set())
+            result = values.copy() if result is None else result & values
+        if result is None:
+            return set(self.coreServers.keys())
+        return result
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Local snapshot of the active servers stored in Racktables DB, so the
+command line tools can select servers without connecting to MySQL"""
+
+import re
+import struct
+from os import rename
+from os.path import expanduser
+from time import time
+from .racktables import racktables
+
+INVENTORY_FILE = expanduser('~/.trovit-inventory.bin')
+INVENTORY_TTL = 600
+
+# File layout (network byte order):
+#   header: magic, format version, creation time, staleness token, servers
+#   server: id, objtype_id, name length, name (utf-8)
+_magic = 'TRVINV'
+_version = 2
+_header = struct.Struct('!6sBd5QI')
+_server = struct.Struct('!IIH')
+
+
+class inventorySnapshot:
+    """
+    Active servers (as returned by racktables.getActiveServers) kept in a
+    compact binary file. The snapshot is used as it is during ttl seconds;
+    after that a single query checks if the inventory changed
+    (racktables.getInventoryToken) and it's only rebuilt if so.
+    """
+
+    def __init__(self, path=INVENTORY_FILE, ttl=INVENTORY_TTL):
+        self._path = path
+        self._ttl = ttl
+        return
+
+    def load(self):
+        """
+        Read the snapshot file
+        Return: tuple(float(created), tuple(token), list[(id,name,type)])
+                or None if there is no valid snapshot
+        """
+        try:
+            with open(self._path, 'rb') as snapFile:
+                data = snapFile.read()
+        except IOError:
+            return None
+        try:
+            fields = _header.unpack_from(data)
+            if fields[0] != _magic or fields[1] != _version:
+                return None
+            created, token, count = fields[2], fields[3:8], fields[8]
+            servers = list()
+            offset = _header.size
+            for i in xrange(0, count):
+                srvId, srvType, size = _server.unpack_from(data, offset)
+                offset += _server.size
+                name = data[offset:offset + size].decode('utf-8')
+                offset += size
+                servers.append((srvId, name, srvType))
+        except (struct.error, UnicodeDecodeError):
+            return None
+        return (created, token, servers)
+
+    def save(self, token, servers):
+        """
+        Write a new snapshot, replacing the previous one atomically
+        Keywords:
+            @token: (tuple) staleness token of the inventory
+            @servers: (list) tuples (id, name, type)
+        Return: None
+        """
+        chunks = [_header.pack(_magic, _version, time(),
+                               *(tuple(token) + (len(servers),)))]
+        for srvId, name, srvType in servers:
+            name = name.encode('utf-8')
+            chunks.append(_server.pack(srvId, srvType, len(name)))
+            chunks.append(name)
+        try:
+            with open('%s.tmp' % self._path, 'wb') as snapFile:
+                snapFile.write(''.join(chunks))
+            rename('%s.tmp' % self._path, self._path)
+        except (IOError, OSError) as err:
+            print("Error saving the inventory in %s (%s)" % (self._path, err))
+        return
+
+    def getActiveServers(self, refresh=False):
+        """
+        Return the active servers from the snapshot, checking Racktables DB
+        only if it's older than its TTL
+        Keywords:
+            @refresh: (boolean) rebuild the snapshot anyway
+        Return: list[(id,name,type), ...]
+        """
+        snapshot = None
+        if not refresh:
+            snapshot = self.load()
+        if snapshot is not None and time() - snapshot[0] <= self._ttl:
+            return snapshot[2]
+        with racktables(readOnly=True) as rt:
+            rt.connect()
+            token = rt.getInventoryToken()
+            if snapshot is not None and tuple(snapshot[1]) == token:
+                # The token proves the snapshot is current: save it again
+                # so the next calls don't connect during another TTL
+                servers = snapshot[2]
+            else:
+                servers = rt.getActiveServers()
+        self.save(token, servers)
+        return servers
+
+    def getServersByName(self, srvName, refresh=False):
+        """
+        Return the active servers matching srvName
+        Keywords:
+            @srvName: (str) Regular Expression for search
+            @refresh: (boolean) rebuild the snapshot anyway
+        Return: list[(id,name,type), ...]
+        """
+        srvRegex = re.compile(srvName)
+        return [server for server in self.getActiveServers(refresh)
+                if srvRegex.match(server[1]) is not None]
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""In-memory index of the IPv4 allocations and networks stored in Racktables
+DB, used to answer IP lookups without querying MySQL"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+class ipamIndex:
+    """
+    Sorted integer array of the allocated IPs (with their allocation
+    records in a parallel list) and the networks grouped by mask.
+    Addresses are always integers, use racktables.ips2int() to convert them
+    in bulk.
+    """
+
+    def __init__(self, rt):
+        self._ips = array('L')
+        self._allocs = list()
+        self._objNames = dict()
+        self._nets = dict()
+        self.load(rt)
+        return
+
+    def load(self, rt):
+        """
+        (Re)load the whole index from Racktables DB
+        Keywords:
+            @rt: (racktables) connected racktables object
+        Return: None
+        """
+        self._objNames = dict(rt.iterQuery("select id, name from Object;"))
+        ips = array('L')
+        allocs = list()
+        for ip, objId, port, ipType in rt.iterQuery(
+                "select ip, object_id, name, type from IPv4Allocation \
+                 order by ip;"):
+            if len(ips) > 0 and ips[-1] == ip:
+                allocs[-1].append((objId, port, ipType))
+            else:
+                ips.append(ip)
+                allocs.append([(objId, port, ipType)])
+        self._ips, self._allocs = ips, allocs
+        self._nets = dict()
+        for netId, ip, mask, name in rt.iterQuery(
+                "select id, ip, mask, name from IPv4Network;"):
+            self._nets.setdefault(int(mask), dict())[ip] = (netId, name)
+        return
+
+    def _find(self, ip):
+        """ Return the position of ip in the array, or -1 """
+        idx = bisect_left(self._ips, ip)
+        if idx < len(self._ips) and self._ips[idx] == ip:
+            return idx
+        return -1
+
+    def getIpInfo(self, ip):
+        """
+        Get the servers and ports where an IP is allocated
+        Keywords:
+            @ip: (int) IP address
+        Return: list[tuple(int(serverId), str(serverName), str(port)), ...]
+        """
+        idx = self._find(ip)
+        if idx < 0:
+            return list()
+        return [(objId, self._objNames.get(objId), port)
+                for objId, port, ipType in self._allocs[idx]]
+
+    def isAllocated(self, ip, ipTypes=None):
+        """
+        Check if an IP is allocated
+        Keywords:
+            @ip: (int) IP address
+            @ipTypes: (list) allocation types accepted, None for any
+        Return: boolean
+        """
+        idx = self._find(ip)
+        if idx < 0:
+            return False
+        if ipTypes is None:
+            return True
+        for objId, port, ipType in self._allocs[idx]:
+            if ipType in ipTypes:
+                return True
+        return False
+
+    def getRange(self, first, last):
+        """
+        Get the allocated IPs between first and last (both included)
+        Keywords:
+            @first: (int) first IP address
+            @last: (int) last IP address
+        Return: list[int(ip), ...]
+        """
+        return self._ips[bisect_left(self._ips, first):
+                         bisect_right(self._ips, last)].tolist()
+
+    def iterAllocations(self):
+        """
+        Iterate over all the allocations in IP order
+        Return: iterator[tuple(int(ip), int(objId), str(port), str(type))]
+        """
+        for ip, allocs in zip(self._ips, self._allocs):
+            for objId, port, ipType in allocs:
+                yield (ip, objId, port, ipType)
+        return
+
+    def getNetworks(self, ip):
+        """
+        Get the networks containing an IP, most specific first
+        Keywords:
+            @ip: (int) IP address
+        Return: list[tuple(int(netId), str(name), int(network), int(mask))]
+        """
+        networks = list()
+        for mask in sorted(self._nets.keys(), reverse=True):
+            network = ip & ((0xffffffff << (32 - mask)) & 0xffffffff)
+            if network in self._nets[mask]:
+                netId, name = self._nets[mask][network]
+                networks.append((netId, name, network, mask))
+        return networks
+
+    def add(self, ip, objId, port, ipType):
+        """
+        Register a new allocation made in the DB
+        Return: None
+        """
+        idx = bisect_left(self._ips, ip)
+        if idx < len(self._ips) and self._ips[idx] == ip:
+            self._allocs[idx].append((objId, port, ipType))
+        else:
+            self._ips.insert(idx, ip)
+            self._allocs.insert(idx, [(objId, port, ipType)])
+        return
+
+    def update(self, ip, objId, port, ipType):
+        """
+        Change the allocations of an IP after an update made in the DB
+        Return: None
+        """
+        idx = self._find(ip)
+        if idx >= 0:
+            self._allocs[idx] = [(objId, port, ipType)
+                                 for alloc in self._allocs[idx]]
+        return
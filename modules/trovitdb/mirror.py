@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Local SQLite copy of the Racktables tables used by the reports. The
+racktables objects created with mirror=path read from it (read-only)
+instead of connecting to MySQL"""
+
+import sqlite3
+from collections import OrderedDict
+from os.path import exists, expanduser
+from time import time
+from . import mdb, trovitdbException
+
+MIRROR_FILE = expanduser('~/.trovit-racktables.sqlite')
+
+# Mirrored tables: (chunk column, primary key, columns). Every table is
+# split in chunks of _chunkSize values of its chunk column, and only the
+# chunks whose checksum changed since the last sync are copied again.
+_tables = OrderedDict([
+    ('Object', ('id', ('id',),
+                ('id', 'name', 'label', 'objtype_id', 'asset_no',
+                 'has_problems', 'comment'))),
+    ('Attribute', ('id', ('id',),
+                   ('id', 'type', 'name'))),
+    ('AttributeMap', ('objtype_id', ('objtype_id', 'attr_id'),
+                      ('objtype_id', 'attr_id', 'chapter_id', 'sticky'))),
+    ('AttributeValue', ('object_id', ('object_id', 'attr_id'),
+                        ('object_id', 'object_tid', 'attr_id',
+                         'string_value', 'uint_value', 'float_value'))),
+    ('Dictionary', ('dict_key', ('dict_key',),
+                    ('chapter_id', 'dict_key', 'dict_sticky',
+                     'dict_value'))),
+    ('TagTree', ('id', ('id',),
+                 ('id', 'parent_id', 'is_assignable', 'tag'))),
+    ('TagStorage', ('entity_id', ('entity_realm', 'entity_id', 'tag_id'),
+                    ('entity_realm', 'entity_id', 'tag_id',
+                     'tag_is_assignable', 'user', 'date'))),
+    ('Port', ('id', ('id',),
+              ('id', 'object_id', 'name', 'iif_id', 'type', 'l2address',
+               'reservation_comment', 'label'))),
+    ('IPv4Allocation', ('object_id', ('object_id', 'ip'),
+                        ('object_id', 'ip', 'name', 'type'))),
+    ('IPv4Network', ('id', ('id',),
+                     ('id', 'ip', 'mask', 'name', 'comment')))])
+# Secondary indexes for the lookups made by racktables
+_indexes = [('Object', 'name'),
+            ('Object', 'objtype_id'),
+            ('AttributeValue', 'attr_id'),
+            ('Dictionary', 'chapter_id'),
+            ('TagStorage', 'tag_id'),
+            ('Port', 'object_id'),
+            ('IPv4Allocation', 'ip'),
+            ('IPv4Network', 'ip')]
+
+
+def _columns(columns):
+    return ', '.join(['`%s`' % column for column in columns])
+
+
+class racktablesMirror:
+    """
+    SQLite file with a copy of the Racktables tables and the checksum of
+    every chunk of rows copied, used to fetch only the chunks changed in
+    the next sync.
+    """
+    _chunkSize = 1000
+
+    def __init__(self, path=MIRROR_FILE):
+        self._path = path
+        self._db = sqlite3.connect(path)
+        self._db.text_factory = unicode
+        self._createSchema()
+        return
+
+    def close(self):
+        """ Close the SQLite file """
+        self._db.close()
+        return
+
+    def _createSchema(self):
+        for table, (chunkColumn, key, columns) in _tables.items():
+            self._db.execute("create table if not exists `%s` (%s, "
+                             "primary key (%s))"
+                             % (table, _columns(columns), _columns(key)))
+        for table, column in _indexes:
+            self._db.execute("create index if not exists `%s_%s` "
+                             "on `%s` (`%s`)"
+                             % (table, column, table, column))
+        self._db.execute("create table if not exists mirror_chunks "
+                         "(tbl, chunk, rows, checksum, "
+                         "primary key (tbl, chunk))")
+        self._db.execute("create table if not exists mirror_info "
+                         "(key primary key, value)")
+        self._db.commit()
+        return
+
+    def lastSync(self):
+        """
+        Return the time of the last sync
+        Return: float(timestamp) or None if it was never synced
+        """
+        row = self._db.execute("select value from mirror_info "
+                               "where key = 'synced'").fetchone()
+        if row is None:
+            return None
+        return float(row[0])
+
+    def _remoteChunks(self, rt, table):
+        """
+        Count and checksum the rows of every chunk of a table in MySQL
+        Return: dict{int(chunk): tuple(int(rows), int(checksum))}
+        """
+        chunkColumn, key, columns = _tables[table]
+        row = ', '.join(['(`%s` is null), `%s`' % (column, column)
+                         for column in columns])
+        chunks = dict()
+        for chunk, rows, checksum in rt.iterQuery(
+                "select floor(`%s` / %s), count(*), \
+                        bit_xor(crc32(concat_ws('#', %s))) \
+                 from `%s` group by 1;"
+                % (chunkColumn, self._chunkSize, row, table)):
+            chunks[int(chunk)] = (int(rows), int(checksum))
+        return chunks
+
+    def _ranges(self, chunks):
+        """ Group consecutive chunks in ranges of chunk column values """
+        ranges = list()
+        for chunk in sorted(chunks):
+            if len(ranges) > 0 and ranges[-1][1] == chunk:
+                ranges[-1][1] = chunk + 1
+            else:
+                ranges.append([chunk, chunk + 1])
+        return [(first * self._chunkSize, last * self._chunkSize)
+                for first, last in ranges]
+
+    def syncTable(self, rt, table):
+        """
+        Copy the chunks of a table changed since the last sync. Any error
+        reading from MySQL leaves the mirrored table as it was.
+        Keywords:
+            @rt: (racktables) connected racktables object
+            @table: (str) table name
+        Return: int(rows copied)
+        """
+        # Inside a transaction the MySQL errors raise instead of cutting
+        # the results short, and the SQLite changes are rolled back
+        with rt.transaction():
+            with self._db:
+                return self._syncTable(rt, table)
+
+    def _syncTable(self, rt, table):
+        """ Copy the changed chunks of a table (SQLite transaction held by
+        the caller) """
+        chunkColumn, key, columns = _tables[table]
+        remote = self._remoteChunks(rt, table)
+        local = dict((chunk, (rows, checksum))
+                     for chunk, rows, checksum in self._db.execute(
+                         "select chunk, rows, checksum from mirror_chunks "
+                         "where tbl = ?", (table,)))
+        changed = [chunk for chunk in set(remote.keys()) | set(local.keys())
+                   if remote.get(chunk) != local.get(chunk)]
+        copied = 0
+        insert = "insert into `%s` (%s) values (%s)" % (
+            table, _columns(columns), ', '.join(['?'] * len(columns)))
+        for first, last in self._ranges(changed):
+            self._db.execute("delete from `%s` where `%s` >= ? "
+                             "and `%s` < ?"
+                             % (table, chunkColumn, chunkColumn),
+                             (first, last))
+            rows = list()
+            for row in rt.iterQuery("select %s from `%s` \
+                                     where `%s` >= %%s and `%s` < %%s;"
+                                    % (_columns(columns), table,
+                                       chunkColumn, chunkColumn),
+                                    (first, last)):
+                rows.append(row)
+                if len(rows) >= self._chunkSize:
+                    self._db.executemany(insert, rows)
+                    copied += len(rows)
+                    rows = list()
+            self._db.executemany(insert, rows)
+            copied += len(rows)
+        for chunk in changed:
+            self._db.execute("delete from mirror_chunks "
+                             "where tbl = ? and chunk = ?",
+                             (table, chunk))
+            if chunk in remote:
+                self._db.execute("insert into mirror_chunks "
+                                 "values (?, ?, ?, ?)",
+                                 (table, chunk) + remote[chunk])
+        return copied
+
+    def sync(self, rt):
+        """
+        Bring every mirrored table up to date. The whole sync is a single
+        SQLite transaction: if anything fails the mirror keeps its previous
+        state.
+        Keywords:
+            @rt: (racktables) connected racktables object
+        Return: OrderedDict{str(table): int(rows copied)}
+        """
+        copied = OrderedDict()
+        # A single transaction reads all the tables from the same snapshot
+        # (and makes the MySQL errors raise)
+        with rt.transaction():
+            with self._db:
+                for table in _tables:
+                    copied[table] = self._syncTable(rt, table)
+                self._db.execute("insert or replace into mirror_info "
+                                 "values ('synced', ?)", (time(),))
+        return copied
+
+
+class mirrorCursor:
+    """
+    SQLite cursor accepting the statements written for mysql.connector
+    (%s placeholders) and raising its exceptions
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        return
+
+    def execute(self, sqlStmt, params=None):
+        try:
+            if params is None:
+                self._cursor.execute(sqlStmt)
+            else:
+                self._cursor.execute(sqlStmt.replace('%s', '?')
+                                     .replace('%%', '%'), tuple(params))
+        except sqlite3.Error as err:
+            raise mdb.DatabaseError(msg="%s" % err)
+        return
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size=1):
+        return self._cursor.fetchmany(size)
+
+    def close(self):
+        self._cursor.close()
+        return
+
+
+class mirrorConnection:
+    """
+    Read-only connection to a mirror file with the part of the
+    mysql.connector interface used by trovitdb
+    """
+
+    def __init__(self, path):
+        if not exists(path):
+            raise trovitdbException("Mirror %s not found, sync it first"
+                                    % path)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.text_factory = unicode
+        self._db.execute("pragma query_only = 1")
+        self.in_transaction = False
+        return
+
+    def cursor(self, buffered=True, prepared=False):
+        return mirrorCursor(self._db.cursor())
+
+    def start_transaction(self, readonly=False):
+        self.in_transaction = True
+        return
+
+    def commit(self):
+        self.in_transaction = False
+        return
+
+    def rollback(self):
+        self.in_transaction = False
+        return
+
+    def close(self):
+        self._db.close()
+        return
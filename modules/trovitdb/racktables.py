@@ -3,11 +3,14 @@
 
 """This module is used to manage objects stored in Racktables DB"""
 
-import re
-from math import pow
 from struct import pack, unpack
 from socket import inet_ntoa, inet_aton
-from . import trovitdb
+from . import trovitdb, trovitdbException
+from .attributes import attributeMatrix
+from .dictionary import dictCache
+from .ipam import ipamIndex
+from .tags import tagIndex
+from .target import parseTarget, compileTarget, matchTarget
 
 _OS = {
     # Jessie
@@ -19,11 +22,30 @@ _OS = {
     # Lenny
     '5': '954'
 }
+# Reverse index of _OS: dictionary key -> Debian version
+_OSVersions = dict((dictKey, version) for version, dictKey in _OS.items())
+
+# Racktables dictionary shared by all the racktables objects
+_dictionary = None
 
 
 class racktables(trovitdb):
     _confSection = 'racktables'
     _ipTypeSet = ['regular', 'shared', 'virtual']
+    _inactiveTags = ['free', 'retired', 'to be retired']
+    _retiredTags = ['retired', 'to be retired']
+    _notRunningValue = 50053
+    _awsChapter = 10001
+    # Seconds before the dictionary cache is reloaded
+    _dictTTL = 300
+
+    def __init__(self, *args, **kwargs):
+        trovitdb.__init__(self, *args, **kwargs)
+        self._ipam = None
+        self._attrs = None
+        self._tags = None
+        self._tagTree = None
+        return
 
     def newServer(self, srvName, serverType):
         """
@@ -38,14 +60,13 @@ class racktables(trovitdb):
         srvType = '4'
         if serverType == 'virtual':
             srvType = '1504'
-        self.query("insert into Object \
+        self.write("insert into Object \
                     (name, objtype_id) \
-                    values ('%s', %s);" %
-                   (srvName, srvType),
-                   'insert')
+                    values (%s, %s);",
+                   (srvName, srvType))
         return
 
-    def newPort(self, srvId, ifName, macAddr, ifType=24):
+    def newPort(self, srvId, ifName, macAddr, ifType=24, iifId=1):
         """
         Insert a new port in the Racktables DB
         Keywords:
@@ -53,41 +74,74 @@ class racktables(trovitdb):
             @ifName: (str) Port name (ethX)
             @macAddr: (str) MAC address
             @ifType: (int) Port type
+            @iifId: (int) Inner interface type (1: hardwired)
         """
-        self.query("insert into Port \
-                    (object_id, name, type, l2address) \
-                    values (%s, '%s', %s, '%s');" %
-                   (srvId, ifName, ifType, macAddr),
-                   'insert')
+        self.write("insert into Port \
+                    (object_id, name, iif_id, type, l2address) \
+                    values (%s, %s, %s, %s, %s);",
+                   (srvId, ifName, iifId, ifType, macAddr))
         return
 
     def getServersByName(self, srvName):
         """
-        Return a server list matching srvName string
+        Return a server list matching srvName string (re.match)
         Keywords:
             @srvName: (str) Regular Expression for search
         Return: list[(id,name,type), ...]
         """
-        srvRegex = re.compile(srvName)
-        srvList = []
-        for server in self.getActiveServers():
-            if srvRegex.match(server[1]) is not None:
-                srvList.append(server)
-        return srvList
+        return self.getServersByTarget([(False, 're', [srvName])])
+
+    def getServersByTarget(self, target):
+        """
+        Return the active servers matching a targeting expression (see
+        trovitdb.target), selected by a single query
+        Keywords:
+            @target: (str) targeting expression, or the terms returned by
+                     target.parseTarget()
+        Return: list[(id,name,type), ...]
+        """
+        if isinstance(target, basestring):
+            target = parseTarget(target)
+        where, params = compileTarget(self, target)
+        return matchTarget(target,
+                           self.query("select id,name,objtype_id \
+                                       from Object where %s;" % where,
+                                      params=tuple(params)))
 
     def getActiveServers(self):
         """
         Return a server list avoiding free, retired or power off servers
+        (tags under them in the tag tree included), selected by a single
+        query: the one of an empty targeting expression
         Return: list[(id,name,type), ...]
         """
-        activeServers = []
-        for server in self.getAllServers():
-            if not self.hasTag(server[0], ['free', 'retired',
-                                           'to be retired']) \
-               and self.isRunning(server[0]) \
-               and server[1] is not None:
-                activeServers.append(server)
-        return activeServers
+        return self.getServersByTarget([])
+
+    def getInventoryToken(self):
+        """
+        Return a fingerprint of the data used by getActiveServers: the
+        number of objects and a checksum of the object names and types, of
+        the tag assignments, of the tag tree (the inherited tags count too)
+        and of the running state attribute. Any rename, tag change or power
+        state change gives a different token.
+        Return: tuple(int, int, int, int, int)
+        """
+        token = self.query("select (select count(*) from Object), \
+                                   (select bit_xor(crc32(concat_ws('#', \
+                                           id, name, objtype_id))) \
+                                    from Object), \
+                                   (select bit_xor(crc32(concat_ws('#', \
+                                           entity_id, tag_id))) \
+                                    from TagStorage \
+                                    where entity_realm = 'object'), \
+                                   (select bit_xor(crc32(concat_ws('#', \
+                                           id, parent_id, tag))) \
+                                    from TagTree), \
+                                   (select bit_xor(crc32(concat_ws('#', \
+                                           object_id, uint_value))) \
+                                    from AttributeValue \
+                                    where attr_id = 10010);")
+        return tuple(int(value or 0) for value in token[0])
 
     def getAllServers(self, serverType='all'):
         """
@@ -96,27 +150,83 @@ class racktables(trovitdb):
             @serverType: (str) One of [all|physical|virtual]
         Return: list[(id,name,type), ...]
         """
+        return list(self.iterAllServers(serverType))
+
+    def iterAllServers(self, serverType='all'):
+        """
+        Iterate over all servers in Racktables DB streaming them from MySQL
+        Keywords:
+            @serverType: (str) One of [all|physical|virtual]
+        Return: iterator[(id,name,type)]
+        """
         srvType = '4,1504'
         if serverType == 'physical':
             srvType = '4'
         if serverType == 'virtual':
             srvType = '1504'
-        machines = self.query("select id,name,objtype_id from Object \
+        return self.iterQuery("select id,name,objtype_id from Object \
                                where objtype_id in (%s);" % srvType)
-        return machines
+
+    def iterSupportReport(self):
+        """
+        Iterate over the physical servers not retired with their service
+        tag, model and support and hardware expiration dates, all of them
+        retrieved by a single streamed query. Retired means the same as in
+        isRetired(): a retired tag or any tag under it.
+        Return: iterator[dict{'id': int, 'name': str, 'serviceTag': str,
+                              'model': str, 'supportEnd': int(timestamp),
+                              'hwEnd': int(timestamp)}]
+        """
+        # -1: no tag has that id, for a tree without the retired tags
+        retiredIds = self.getSubtagIds(self._retiredTags) or [-1]
+        for row in self.iterQuery("select Object.id, Object.name, \
+                                          Object.asset_no, \
+                                          Dictionary.dict_value, \
+                                          support.uint_value, \
+                                          hardware.uint_value \
+                                   from Object \
+                                   left join AttributeValue model \
+                                     on (model.object_id = Object.id \
+                                       and model.attr_id = 2) \
+                                   left join AttributeMap \
+                                     on (AttributeMap.attr_id = 2 \
+                                       and AttributeMap.objtype_id = \
+                                           model.object_tid) \
+                                   left join Dictionary \
+                                     on (Dictionary.chapter_id = \
+                                           AttributeMap.chapter_id \
+                                       and Dictionary.dict_key = \
+                                           model.uint_value) \
+                                   left join AttributeValue support \
+                                     on (support.object_id = Object.id \
+                                       and support.attr_id = 21) \
+                                   left join AttributeValue hardware \
+                                     on (hardware.object_id = Object.id \
+                                       and hardware.attr_id = 22) \
+                                   where Object.objtype_id = 4 \
+                                     and not exists ( \
+                                       select 1 from TagStorage \
+                                       where TagStorage.entity_id = \
+                                             Object.id \
+                                         and TagStorage.entity_realm = \
+                                             'object' \
+                                         and TagStorage.tag_id in (%s));"
+                                  % ','.join(['%s'] * len(retiredIds)),
+                                  tuple(retiredIds)):
+            yield {'id': row[0],
+                   'name': row[1] or '',
+                   'serviceTag': row[2] or '',
+                   'model': row[3] or '',
+                   'supportEnd': int(row[4] or 0),
+                   'hwEnd': int(row[5] or 0)}
+        return
 
     def getAwsInstances(self):
         """
         Return the instances registered into the Racktables dictionary
         Return: dict{str(instance-type): int(id)}
         """
-        instances = {}
-        regInstances = self.query("select dict_key, dict_value \
-                                   from Dictionary \
-                                   where chapter_id = 10001;")
-        for instEntry in regInstances:
-            instances[instEntry[1]] = instEntry[0]
-        return instances
+        return self.getDictionary().getChapterValues(self._awsChapter)
 
     def getLastDictId(self):
         """
@@ -136,6 +246,72 @@ class racktables(trovitdb):
         """
         return self.getAllServers('physical')
 
+    def getAttributeMatrix(self, objectIds, attrIds, chunkSize=1000):
+        """
+        Retrieve the values of many attributes for many objects, with one
+        query per chunk of objects. Dictionary attributes are decoded
+        through the dictionary cache.
+        Keywords:
+            @objectIds: (list) Object IDs
+            @attrIds: (list) Attribute IDs
+            @chunkSize: (int) Object IDs sent in every query
+        Return: attributeMatrix
+        """
+        matrix = attributeMatrix(objectIds, attrIds)
+        if len(matrix.objectIds) == 0 or len(matrix.attrIds) == 0:
+            return matrix
+        dictionary = self.getDictionary()
+        attrList = ','.join(['%s'] * len(matrix.attrIds))
+        for idx in xrange(0, len(matrix.objectIds), chunkSize):
+            chunk = matrix.objectIds[idx:idx + chunkSize]
+            objList = ','.join(['%s'] * len(chunk))
+            for objId, objType, attrId, attrType, strVal, uintVal, \
+                    floatVal in self.iterQuery(
+                        "select AttributeValue.object_id, \
+                                AttributeValue.object_tid, \
+                                AttributeValue.attr_id, Attribute.type, \
+                                AttributeValue.string_value, \
+                                AttributeValue.uint_value, \
+                                AttributeValue.float_value \
+                         from AttributeValue \
+                         inner join Attribute \
+                           on Attribute.id = AttributeValue.attr_id \
+                         where AttributeValue.object_id in (%s) \
+                           and AttributeValue.attr_id in (%s);"
+                        % (objList, attrList),
+                        tuple(chunk) + tuple(matrix.attrIds)):
+                if attrType == 'string':
+                    value = strVal
+                elif attrType == 'float':
+                    value = floatVal
+                elif attrType == 'dict':
+                    chapterId = dictionary.getChapter(objType, attrId)
+                    value = None
+                    if chapterId is not None:
+                        value = dictionary.getValue(uintVal, chapterId)
+                else:
+                    value = uintVal
+                matrix.set(objId, attrId, value, uintVal, attrType)
+        return matrix
+
+    def prefetchAttributes(self, objectIds, attrIds):
+        """
+        Load an attribute matrix used by getServerAttribute and
+        getServerAttrDict instead of querying every object/attribute pair
+        Keywords:
+            @objectIds: (list) Object IDs
+            @attrIds: (list) Attribute IDs
+        Return: attributeMatrix
+        """
+        self._attrs = self.getAttributeMatrix(objectIds, attrIds)
+        return self._attrs
+
+    def _attrChanged(self, objId, attrId):
+        """ Invalidate the prefetched value of a modified attribute """
+        if self._attrs is not None:
+            self._attrs.invalidate(objId, attrId)
+        return
+
     def getServerAttribute(self, serverId, attrId):
         """
         Retrieve the attribute matching with serverId & attrId given
@@ -145,6 +321,10 @@ class racktables(trovitdb):
         Return: str(data)
         """
         data = ''
+        if self._attrs is not None and self._attrs.covers(serverId, attrId):
+            if self._attrs.has(serverId, attrId):
+                data = self._attrs.raw(serverId, attrId)
+            return str(data)
         attr = self.query("select uint_value from AttributeValue \
                            where object_id = %s \
                              and attr_id = %s" % (serverId, attrId))
@@ -161,21 +341,37 @@ class racktables(trovitdb):
         Return: str(data)
         """
         data = ''
-        sql = "select dict_value from Dictionary \
-               inner join AttributeMap \
-                 on Dictionary.chapter_id = AttributeMap.chapter_id \
-               inner join AttributeValue \
-                 on (AttributeValue.uint_value = Dictionary.dict_key \
-                   and AttributeMap.objtype_id = AttributeValue.object_tid) \
-               inner join Object \
-                 on Object.id = AttributeValue.object_id \
-               where Object.id = %s \
-                 and AttributeMap.attr_id = %s;" % (serverId, attrId)
-        dictVal = self.query(sql)
-        if len(dictVal) > 0:
-            data = dictVal[0][0]
+        if self._attrs is not None and self._attrs.covers(serverId, attrId):
+            if self._attrs.attrTypes.get(attrId) == 'dict':
+                data = self._attrs.get(serverId, attrId) or data
+            return data
+        attr = self.query("select object_tid, uint_value \
+                           from AttributeValue \
+                           where object_id = %s \
+                             and attr_id = %s;",
+                          params=(serverId, attrId))
+        if len(attr) > 0:
+            dictionary = self.getDictionary()
+            chapterId = dictionary.getChapter(attr[0][0], attrId)
+            if chapterId is not None:
+                data = dictionary.getValue(attr[0][1], chapterId) or data
         return data
 
+    def getDictionary(self, refresh=False):
+        """
+        Return the dictionary cache shared by all the racktables objects of
+        the process, (re)loading it the first time or after its TTL
+        Keywords:
+            @refresh: (boolean) reload it anyway
+        Return: dictCache
+        """
+        global _dictionary
+        if _dictionary is None:
+            _dictionary = dictCache(self, self._dictTTL)
+        elif refresh or _dictionary.isExpired():
+            _dictionary.load(self)
+        return _dictionary
+
     def getServerTags(self, serverId):
         """
         Return a list with all tags associated with a server
@@ -183,17 +379,12 @@ class racktables(trovitdb):
             @serverId: (int) Server Object ID
         Return: list[str(tag), ...]
         """
-        tags = []
-        data = self.query("select entity_id,tag from TagStorage \
-                           left join TagTree \
-                           on TagStorage.tag_id = TagTree.id \
-                           where entity_id = %s;" % serverId)
-        map(lambda x: tags.append(x[1]), data)
-        return tags
+        return list(self.getTagIndex().getTags(serverId))
 
     def hasTag(self, serverId, tags):
         """
-        Check if the server has the tag requested in tags parameter
+        Check if the server has the tag requested in tags parameter. The
+        parents of the server tags in the tag tree also match.
         Keywords:
             @serverId: (int) Server Object ID
             @tags: (list[(str), ...]) List of tags to search
@@ -204,11 +395,51 @@ class racktables(trovitdb):
             targetTags = tags
         else:
             targetTags.append(tags)
-        serverTags = self.getServerTags(serverId)
-        for tag in targetTags:
-            if tag in serverTags:
-                return True
-        return False
+        return self.getTagIndex().hasTag(serverId, targetTags)
+
+    def getTaggedObjects(self, tag):
+        """
+        Return the objects having a tag (directly or by inheritance)
+        Keywords:
+            @tag: (str) Tag name
+        Return: list[int(objectId), ...]
+        """
+        return sorted(self.getTagIndex().getEntities(tag))
+
+    def getSubtagIds(self, tags):
+        """
+        Return the ids of the tags and of all the tags under them in the tag
+        tree. Only TagTree is read (once per object), not the assignments.
+        Keywords:
+            @tags: (list) tag names
+        Return: list[int(tagId), ...]
+        """
+        if self._tagTree is None:
+            children, tagIds = dict(), dict()
+            for tagId, parentId, tag in self.iterQuery(
+                    "select id, parent_id, tag from TagTree;"):
+                children.setdefault(parentId, list()).append(tagId)
+                tagIds[tag] = tagId
+            self._tagTree = (children, tagIds)
+        children, tagIds = self._tagTree
+        found = set()
+        pending = [tagIds[tag] for tag in tags if tag in tagIds]
+        while len(pending) > 0:
+            tagId = pending.pop()
+            if tagId not in found:
+                found.add(tagId)
+                pending.extend(children.get(tagId, []))
+        return sorted(found)
+
+    def getTagIndex(self):
+        """
+        Return the tag index, loading the tag tree and all the tag
+        assignments the first time
+        Return: tagIndex
+        """
+        if self._tags is None:
+            self._tags = tagIndex(self)
+        return self._tags
 
     def getServerVersion(self, serverId):
         """
@@ -220,11 +451,7 @@ class racktables(trovitdb):
         data = ''
         attrOS = self.getServerAttribute(serverId, 4)
         if attrOS != '':
-            for attrVal in _OS.keys():
-                if _OS[attrVal] == attrOS:
-                    data = attrVal
-            if data == '':
-                data = 'Unknown value'
+            data = _OSVersions.get(attrOS, 'Unknown value')
         return data
 
     def getServerHwEnd(self, serverId):
@@ -295,10 +522,10 @@ class racktables(trovitdb):
         Return: None
         """
         if osversion in _OS:
-            self.query("insert into AttributeValue \
-                        values (%s,%s,4,NULL,%s,NULL);" %
-                       (serverId, serverType, _OS[osversion]),
-                       'insert')
+            self.write("insert into AttributeValue \
+                        values (%s,%s,4,NULL,%s,NULL);",
+                       (serverId, serverType, _OS[osversion]))
+            self._attrChanged(serverId, 4)
         else:
             print("Unknown OS version: \'%s\'" % osversion)
         return
@@ -310,11 +537,7 @@ class racktables(trovitdb):
             @serverId: (int) Server Object ID
         Return: boolean
         """
-        srvTags = self.getServerTags(serverId)
-        if 'retired' in srvTags \
-           or 'to be retired' in srvTags:
-            return True
-        return False
+        return self.hasTag(serverId, self._retiredTags)
 
     def isRunning(self, serverId):
         """
@@ -327,7 +550,7 @@ class racktables(trovitdb):
                             where attr_id = 10010 \
                               and object_id = %s;" % serverId)
         if len(check) > 0:
-            if check[0][0] == 50053:
+            if check[0][0] == self._notRunningValue:
                 return False
         return True
 
@@ -339,11 +562,12 @@ class racktables(trovitdb):
             @value: (str) Value for the new record
         Return: None
         """
-        dictKey = self.getLastDictId()
-        self.query("insert into Dictionary \
-                    values (%s,%s,'no','%s');" %
-                   (chapterId, dictKey, value),
-                   'insert')
+        dictKey = self.getLastDictId() + 1
+        self.write("insert into Dictionary \
+                    values (%s,%s,'no',%s);",
+                   (chapterId, dictKey, value))
+        if _dictionary is not None:
+            _dictionary.invalidate()
         return
 
     def updateVersion(self, serverId, osversion):
@@ -355,12 +579,13 @@ class racktables(trovitdb):
         Return: None
         """
         if osversion in _OS:
-            self.query("update AttributeValue \
+            self.write("update AttributeValue \
                         set uint_value=%s \
                         where object_id = %s \
-                            and attr_id = 4;" %
+                            and attr_id = 4;",
                        (_OS[osversion], serverId),
                        'update')
+            self._attrChanged(serverId, 4)
         else:
             print("%s Wrong OS version \'%s\' for ID %s" %
                   (self._errorMsg, osversion, serverId))
@@ -416,11 +641,13 @@ class racktables(trovitdb):
     def getIpInfo(self, ip):
         """
         Retrieve IP related info (serverId, server, port) from racktables
-        database.
+        database, or from the IPAM index if it's loaded.
         Keywords:
             @ip: (str) IP in human readable format
         Return: list[tuple(int(serverId), str(serverName), str(port)), ...]
         """
+        if self._ipam is not None:
+            return self._ipam.getIpInfo(ip2int(ip))
         data = self.query("select Object.id, Object.name, IPv4Allocation.name \
                            from Object \
                            left join IPv4Allocation \
@@ -430,24 +657,28 @@ class racktables(trovitdb):
 
     def isAllocatedIp(self, ip, ipType='all'):
         """
-        Check if the given IP address is into IPv4Allocation table
+        Check if the given IP address is into IPv4Allocation table (or the
+        IPAM index if it's loaded)
         Keywords:
             @ip: (str) IP address in human readable format
             @ipType: (str) racktables IP type [regular, shared, virtual, all]
         Return: boolean
         """
         if ipType == 'all':
-            queryType = ('\'%s\'' % '\',\''.join(self._ipTypeSet))
+            ipTypes = self._ipTypeSet
         elif ipType in self._ipTypeSet:
-            queryType = ipType
+            ipTypes = [ipType]
         else:
-            raise trovitdb.trovitdbException("Wrong IP type %s. Choose: "
-                                             "[all, %s]"
-                                             % (ipType, queryType))
+            raise trovitdbException("Wrong IP type %s. Choose: "
+                                    "[all, %s]"
+                                    % (ipType, ', '.join(self._ipTypeSet)))
+        if self._ipam is not None:
+            return self._ipam.isAllocated(ip2int(ip), ipTypes)
         data = self.query("select * from IPv4Allocation \
-                           where ip = %s \
+                           where ip = %%s \
                              and type in (%s);"
-                          % (ip2int(ip), queryType))
+                          % ','.join(['%s'] * len(ipTypes)),
+                          params=tuple([ip2int(ip)] + ipTypes))
         if len(data) > 0:
             return True
         return False
@@ -464,12 +695,15 @@ class racktables(trovitdb):
             null
         """
         if ipType not in self._ipTypeSet:
-            raise trovitdb.trovitdbException("Wrong IP type %s." % ipType)
-        self.query("insert into IPv4Allocation \
+            raise trovitdbException("Wrong IP type %s." % ipType)
+        self.write("insert into IPv4Allocation \
                     (object_id, ip, name, type) \
-                    values (%s, %s, '%s', '%s');"
-                   % (serverId, ip2int(ip), port, ipType),
-                   'insert')
+                    values (%s, %s, %s, %s);",
+                   (serverId, ip2int(ip), port, ipType))
+        # Reached only if the insert was sent or queued (write() raises on
+        # errors); queued writes undone later drop the index
+        if self._ipam is not None:
+            self._ipam.add(ip2int(ip), serverId, port, ipType)
         return
 
     def updateIp(self, ip, serverId, port, ipType='regular'):
@@ -484,14 +718,35 @@ class racktables(trovitdb):
             null
         """
         if ipType not in self._ipTypeSet:
-            raise trovitdb.trovitdbException("Wrong IP type %s." % ipType)
-        self.query("update IPv4Allocation \
+            raise trovitdbException("Wrong IP type %s." % ipType)
+        self.write("update IPv4Allocation \
                     set object_id = %s, \
-                        name = '%s', \
-                        type = '%s' \
-                    where ip = %s;"
-                   % (serverId, port, ipType, ip2int(ip)),
+                        name = %s, \
+                        type = %s \
+                    where ip = %s;",
+                   (serverId, port, ipType, ip2int(ip)),
                    'update')
+        # Reached only if the update was sent or queued (see allocateIp)
+        if self._ipam is not None:
+            self._ipam.update(ip2int(ip), serverId, port, ipType)
+        return
+
+    def loadIpamIndex(self):
+        """
+        Load all the IPv4 allocations and networks in memory. From then on
+        getIpInfo() and isAllocatedIp() are answered from the index, which
+        is kept updated by allocateIp() and updateIp() with the writes
+        which succeed, and dropped when queued writes are undone.
+        Return: ipamIndex
+        """
+        self._ipam = ipamIndex(self)
+        return self._ipam
+
+    def _writesDiscarded(self):
+        """ The IPAM index was updated when the writes were queued, so it
+        may hold allocations which aren't in the DB: drop it, the lookups
+        go back to MySQL until it's loaded again """
+        self._ipam = None
         return
 
     def getFreeIP(self, netName, reserved_step):
@@ -501,24 +756,110 @@ class racktables(trovitdb):
             @netName: (str) Name of the net to check
             @reserved_step: (int) In some environments the first IP's
                             are reserved for FW's or switches
+        Return: int(ip) or 0 if the network is full
         """
-        ipRange = self.query("select ip, mask from IPv4Network \
-                              where name = '%s';" % netName)
-        minimum = int(ipRange[0][0])
-        maximum = (int(ipRange[0][0]) + pow(2, int(ipRange[0][1])))
-        usedIps = self.query("select ip from IPv4Allocation \
-                              where ip >= %s and ip <= %s \
-                              order by ip;" %
-                             (minimum, maximum))
-        ipList = list()
-        map(lambda x: ipList.append(x[0]), usedIps)
-        i = minimum + reserved_step
-        while i < maximum:
-            if i not in ipList:
-                return i
-            i += 1
+        freeIps = self.getFreeIPs(netName, reserved_step)
+        if len(freeIps) > 0:
+            return freeIps[0]
         return 0
 
+    def getNetworkRange(self, netName):
+        """
+        Get the first and last addresses of a network
+        Keywords:
+            @netName: (str) Name of the net
+        Return: tuple(int(network address), int(broadcast address))
+        """
+        ipRange = self.query("select ip, mask from IPv4Network \
+                              where name = %s;", params=(netName,))
+        if len(ipRange) == 0:
+            raise trovitdbException("Unknown network %s" % netName)
+        network = int(ipRange[0][0])
+        return (network, network + (1 << (32 - int(ipRange[0][1]))) - 1)
+
+    def getFreeIPs(self, netName, reserved_step=0, count=1,
+                   contiguous=False):
+        """
+        Get free IPs in the specified network. The used addresses are loaded
+        in a single range scan into a bitmap (one bit per address) which is
+        then walked skipping the full bytes.
+        Keywords:
+            @netName: (str) Name of the net to check
+            @reserved_step: (int) In some environments the first IP's
+                            are reserved for FW's or switches
+            @count: (int) Number of IPs wanted
+            @contiguous: (bool) Return only a block of consecutive IPs
+        Return: list[int(ip), ...] (shorter than count, or empty for a
+                contiguous block, if there aren't enough free IPs)
+        """
+        network, broadcast = self.getNetworkRange(netName)
+        first = network + reserved_step
+        last = broadcast
+        if broadcast - network > 1:
+            last -= 1
+        size = last - first + 1
+        if size <= 0:
+            return list()
+        bitmap = bytearray((size + 7) >> 3)
+        for usedIp in self.iterQuery("select ip from IPv4Allocation \
+                                      where ip >= %s and ip <= %s;",
+                                     (first, last)):
+            offset = usedIp[0] - first
+            bitmap[offset >> 3] |= 1 << (offset & 7)
+        # Bits after the last address are marked as used
+        for offset in xrange(size, len(bitmap) << 3):
+            bitmap[offset >> 3] |= 1 << (offset & 7)
+        freeIps = list()
+        for idx, byte in enumerate(bitmap):
+            if byte == 0xff:
+                if contiguous:
+                    freeIps = list()
+                continue
+            for bit in xrange(0, 8):
+                if byte & (1 << bit):
+                    if contiguous:
+                        freeIps = list()
+                    continue
+                freeIps.append(first + (idx << 3) + bit)
+                if len(freeIps) == count:
+                    return freeIps
+        if contiguous:
+            return list()
+        return freeIps
+
+    def allocateFreeIPs(self, netName, reserved_step, serverId, port,
+                        count=1, contiguous=False, ipType='regular'):
+        """
+        Find free IPs in a network and allocate them to a server port in the
+        same transaction. The network row is locked meanwhile, so concurrent
+        allocations in the same network can't take the same addresses. It
+        can't be used inside a batch (the inserts would be sent after the
+        lock is released) and it raises if any insert fails.
+        Keywords:
+            @netName: (str) Name of the net
+            @reserved_step: (int) Addresses reserved at the network start
+            @serverId: (int) Server Object ID
+            @port: (str) Port name
+            @count: (int) Number of IPs to allocate
+            @contiguous: (bool) Allocate a block of consecutive IPs
+            @ipType: (str) One of (regular, shared, virtual)
+        Return: list[int(ip), ...]
+        """
+        if self._batch is not None:
+            raise trovitdbException("Free IPs can't be allocated inside a "
+                                    "batch")
+        with self.transaction():
+            self.query("select id from IPv4Network \
+                        where name = %s for update;", params=(netName,))
+            freeIps = self.getFreeIPs(netName, reserved_step, count,
+                                      contiguous)
+            if len(freeIps) < count:
+                raise trovitdbException("Not enough free IPs in %s"
+                                        % netName)
+            for ip in freeIps:
+                self.allocateIp(int2ip(ip), serverId, port, ipType)
+        return freeIps
+
 
 def ip2int(addr):
     """
@@ -532,3 +873,19 @@ def int2ip(addr):
     Transform an integer to a human readable IP address
     """
     return inet_ntoa(pack("!I", addr))
+
+
+def ips2int(addrs):
+    """
+    Transform a list of human readable IP addresses to integers
+    """
+    return list(unpack("!%dI" % len(addrs), ''.join(map(inet_aton, addrs))))
+
+
+def ints2ip(addrs):
+    """
+    Transform a list of integers to human readable IP addresses
+    """
+    packed = pack("!%dI" % len(addrs), *addrs)
+    return [inet_ntoa(packed[idx:idx + 4])
+            for idx in xrange(0, len(packed), 4)]
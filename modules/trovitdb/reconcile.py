@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Reconciliation of the network interfaces found in the servers with the
+ports and IP allocations stored in Racktables DB"""
+
+import json
+import sys
+from .racktables import ip2int
+
+# Plan actions applied by netReconciler.apply()
+APPLICABLE = ('addPort', 'allocateIp')
+
+
+def describe(action):
+    """
+    Return a human readable line for a plan action
+    """
+    kind = action['action']
+    if kind == 'addPort':
+        return "Add port %s (%s) to %s" % (action['iface'], action['mac'],
+                                            action['server'])
+    if kind == 'macMismatch':
+        return "!!! %s:%s MAC mismatch: %s <=> %s" % (action['server'],
+                                                      action['iface'],
+                                                      action['mac'],
+                                                      action['dbMac'])
+    if kind == 'allocateIp':
+        return "Allocate %s (%s) in %s" % (action['ip'], action['iface'],
+                                           action['server'])
+    if kind == 'ipConflict':
+        return "!! IP address %s (%s:%s) is registered at %s" % (
+            action['ip'], action['server'], action['iface'],
+            ', '.join(['%s:%s' % (owner[1], owner[2])
+                       for owner in action['owners']]))
+    return "%s" % action
+
+
+def dumpPlan(plan, fd):
+    """
+    Write a plan as JSON
+    Keywords:
+        @plan: (list) actions returned by netReconciler.plan()
+        @fd: (file) destination
+    Return: None
+    """
+    json.dump(plan, fd, indent=2, sort_keys=True)
+    fd.write('\n')
+    return
+
+
+class netReconciler:
+    """
+    Compare the interfaces observed in the servers with the DB state,
+    loaded in bulk for the whole fleet, and build a plan of actions:
+        addPort: the interface isn't registered as a port
+        macMismatch: the port has another MAC address in the DB
+        allocateIp: the IP isn't allocated in the DB
+        ipConflict: the IP is allocated to another server or port
+    Only addPort and allocateIp can be applied, the others are reported to
+    be solved by hand.
+    """
+    _ignoredIfaces = ['lo', 'kvm']
+
+    def __init__(self, rt):
+        self._rt = rt
+        self._ports = dict()
+        self._ips = dict()
+        self._ipam = None
+        return
+
+    def load(self, serverIds, chunkSize=1000):
+        """
+        Load the ports and IP allocations of the servers
+        Keywords:
+            @serverIds: (list) Server Object IDs
+            @chunkSize: (int) Object IDs sent in every query
+        Return: None
+        """
+        serverIds = list(serverIds)
+        self._ports = dict((serverId, dict()) for serverId in serverIds)
+        for idx in xrange(0, len(serverIds), chunkSize):
+            chunk = serverIds[idx:idx + chunkSize]
+            for objId, iface, mac in self._rt.iterQuery(
+                    "select object_id, name, l2address from Port \
+                     where object_id in (%s);"
+                    % ','.join(['%s'] * len(chunk)), tuple(chunk)):
+                self._ports[objId][iface] = mac
+        # The IPAM index also answers who owns every IP
+        self._ipam = self._rt.loadIpamIndex()
+        self._ips = dict((serverId, dict()) for serverId in serverIds)
+        for ip, objId, iface, ipType in self._ipam.iterAllocations():
+            if objId in self._ips:
+                self._ips[objId].setdefault(iface, set()).add(ip)
+        return
+
+    def diff(self, serverId, serverName, observed, planned=None):
+        """
+        Compare the interfaces of a server with the loaded DB state
+        Keywords:
+            @serverId: (int) Server Object ID
+            @serverName: (str) Server name
+            @observed: (dict) interfaces as returned by
+                       remote.parseIpAddr()
+            @planned: (dict) IPs allocated by previous actions of the plan
+        Return: list[dict(action), ...]
+        """
+        if planned is None:
+            planned = dict()
+        actions = list()
+        ports = self._ports.get(serverId, dict())
+        ips = self._ips.get(serverId, dict())
+        for iface in sorted(observed.keys()):
+            if iface in self._ignoredIfaces:
+                continue
+            mac = observed[iface]['mac']
+            base = {'serverId': serverId, 'server': serverName,
+                    'iface': iface}
+            if iface not in ports:
+                actions.append(dict(base, action='addPort', mac=mac))
+            elif ports[iface] != mac:
+                actions.append(dict(base, action='macMismatch', mac=mac,
+                                    dbMac=ports[iface]))
+            for cidr in observed[iface]['ip']:
+                ip, mask = cidr.split('/')
+                if int(mask) == 32:
+                    continue
+                intIp = ip2int(ip)
+                if intIp in ips.get(iface, ()):
+                    continue
+                owners = [list(owner) for owner in
+                          self._ipam.getIpInfo(intIp)]
+                if intIp in planned:
+                    owners.append(list(planned[intIp]))
+                if len(owners) > 0:
+                    actions.append(dict(base, action='ipConflict', ip=ip,
+                                        owners=owners))
+                else:
+                    planned[intIp] = (serverId, serverName, iface)
+                    actions.append(dict(base, action='allocateIp', ip=ip))
+        return actions
+
+    def plan(self, servers, observed):
+        """
+        Build the plan for many servers
+        Keywords:
+            @servers: (list) tuples (id, name, type)
+            @observed: (dict) {int(serverId): interfaces of
+                       remote.parseIpAddr()}
+        Return: list[dict(action), ...]
+        """
+        actions = list()
+        planned = dict()
+        for server in servers:
+            if server[0] in observed:
+                actions.extend(self.diff(server[0], server[1],
+                                         observed[server[0]], planned))
+        return actions
+
+    def apply(self, plan, actions=APPLICABLE):
+        """
+        Apply the actions of a plan in batched transactions
+        Keywords:
+            @plan: (list) actions returned by plan()
+            @actions: (list) kinds of action to apply
+        Return: list[tuple(sqlStmt, params, str(error)), ...] failed writes
+        """
+        with self._rt.batch() as writer:
+            for action in plan:
+                if action['action'] not in actions:
+                    continue
+                if action['action'] == 'addPort':
+                    self._rt.newPort(action['serverId'], action['iface'],
+                                     action['mac'])
+                    self._ports.setdefault(action['serverId'], dict())[
+                        action['iface']] = action['mac']
+                elif action['action'] == 'allocateIp':
+                    self._rt.allocateIp(action['ip'], action['serverId'],
+                                        action['iface'])
+                    self._ips.setdefault(action['serverId'], dict()) \
+                        .setdefault(action['iface'], set()) \
+                        .add(ip2int(action['ip']))
+        return writer.failures
+
+
+def reconcileServers(rt, sshOps, kinds=None, apply=False, planFile=None,
+                     workers=1, maxAge=None):
+    """
+    Compare the interfaces of all the active servers with the DB, print
+    the plan and apply it if requested (flow shared by the update-ifaces
+    and update-macs scripts)
+    Keywords:
+        @rt: (racktables) connected racktables object
+        @sshOps: (serverGroup) SSH connections to the servers
+        @kinds: (list) kinds of action included in the plan, all of them
+                by default
+        @apply: (boolean) apply the plan
+        @planFile: (str) file where the plan is written as JSON. With -
+                   it's written to stdout and the messages to stderr
+        @workers: (int) servers queried at the same time
+        @maxAge: (int) maximum age of the cached facts, see
+                 serverGroup.collectFacts()
+    Return: list[dict(action), ...]
+    """
+    # Keep stdout clean for the JSON plan
+    out = sys.stderr if planFile == '-' else sys.stdout
+    servers = rt.getActiveServers()
+    facts, errors = sshOps.collectFacts([server[1] for server in servers],
+                                        workers=workers, maxAge=maxAge)
+    observed = dict()
+    for server in servers:
+        # server: (id,name,type)
+        if server[1] in errors:
+            out.write('%s\n' % errors[server[1]])
+        elif server[1] in facts:
+            observed[server[0]] = facts[server[1]]['interfaces']
+    # DB state of the whole fleet in a few queries
+    reconciler = netReconciler(rt)
+    reconciler.load([server[0] for server in servers])
+    plan = [action for action in reconciler.plan(servers, observed)
+            if kinds is None or action['action'] in kinds]
+    for action in plan:
+        out.write('%s\n' % describe(action))
+    if planFile == '-':
+        dumpPlan(plan, sys.stdout)
+    elif planFile is not None:
+        with open(planFile, 'w') as planFd:
+            dumpPlan(plan, planFd)
+    if apply:
+        for sqlStmt, params, error in reconciler.apply(plan):
+            out.write("Error applying %s: %s\n" % (params, error))
+    return plan
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""In-memory index of the Racktables tag tree and the tags assigned to
+every object, used to answer tag checks without querying MySQL"""
+
+
+class tagIndex:
+    """
+    Tags assigned to every object, both the ones stored in TagStorage and
+    the ones inherited from the tag tree (a child tag implies its parents).
+    Every tag name is a single shared string and objects with the same
+    tags share the same frozenset, so the index stays small even for the
+    whole fleet.
+    """
+
+    def __init__(self, rt):
+        self._lineage = dict()
+        self._direct = dict()
+        self._effective = dict()
+        self._entities = dict()
+        self.load(rt)
+        return
+
+    def load(self, rt):
+        """
+        (Re)load the tag tree and the tags of every object
+        Keywords:
+            @rt: (racktables) connected racktables object
+        Return: None
+        """
+        names, parents = dict(), dict()
+        for tagId, parentId, tag in rt.iterQuery(
+                "select id, parent_id, tag from TagTree;"):
+            # One string object per tag shared by all the sets below
+            names[tagId] = tag
+            parents[tagId] = parentId
+        # Every tag with all its ancestors
+        lineage = dict()
+        for tagId, tag in names.items():
+            tags, seen, parentId = [tag], set([tagId]), parents[tagId]
+            while parentId in names and parentId not in seen:
+                seen.add(parentId)
+                tags.append(names[parentId])
+                parentId = parents[parentId]
+            lineage[tag] = frozenset(tags)
+        assigned = dict()
+        for entityId, tagId in rt.iterQuery(
+                "select entity_id, tag_id from TagStorage \
+                 where entity_realm = 'object';"):
+            if tagId in names:
+                assigned.setdefault(entityId, set()).add(names[tagId])
+        shared = dict()
+        direct, effective, entities = dict(), dict(), dict()
+        for entityId, tags in assigned.items():
+            direct[entityId] = shared.setdefault(frozenset(tags),
+                                                 frozenset(tags))
+            allTags = frozenset().union(*[lineage[tag] for tag in tags])
+            effective[entityId] = shared.setdefault(allTags, allTags)
+            for tag in allTags:
+                entities.setdefault(tag, set()).add(entityId)
+        self._lineage = lineage
+        self._direct, self._effective = direct, effective
+        self._entities = entities
+        return
+
+    def getTags(self, entityId, inherited=False):
+        """
+        Get the tags of an object
+        Keywords:
+            @entityId: (int) Object ID
+            @inherited: (boolean) include the parents of the assigned tags
+        Return: frozenset(str(tag), ...)
+        """
+        if inherited:
+            return self._effective.get(entityId, frozenset())
+        return self._direct.get(entityId, frozenset())
+
+    def hasTag(self, entityId, tags):
+        """
+        Check if an object has (directly or by inheritance) any of the tags
+        Keywords:
+            @entityId: (int) Object ID
+            @tags: (list) tag names
+        Return: boolean
+        """
+        entityTags = self._effective.get(entityId)
+        if entityTags is None:
+            return False
+        for tag in tags:
+            if tag in entityTags:
+                return True
+        return False
+
+    def getEntities(self, tag):
+        """
+        Get the objects having a tag (directly or by inheritance)
+        Keywords:
+            @tag: (str) tag name
+        Return: set(int(entityId), ...)
+        """
+        return self._entities.get(tag, set())
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Server targeting expressions, compiled to a single SQL query over the
+active servers of Racktables DB (the name regular expressions are matched
+afterwards, in Python).
+
+An expression is a list of terms separated by spaces, a server must match
+all of them. Every term is [!]key:value[,value...] (any of the values,
+negated with !) or a bare regular expression on the server name:
+    name:GLOB       server name, with * and ? wildcards
+    re:REGEX        server name Python regular expression, anchored at the
+                    start (re.match)
+    tag:TAG         tag, or any tag under it in the tag tree
+    type:TYPE       physical, virtual or an objtype id
+    os:VERSION      Debian major version
+    model:GLOB      hardware model
+    net:CIDR        an IP allocated inside the network (or a single IP)
+Example: 'tag:prod os:7,8 !name:*-old net:10.2.0.0/16'
+"""
+
+import re
+from socket import error as socketError
+
+
+class targetException(Exception):
+    pass
+
+
+_objTypes = {'physical': 4, 'virtual': 1504}
+
+
+def parseTarget(expression):
+    """
+    Split a targeting expression in terms
+    Keywords:
+        @expression: (str) targeting expression
+    Return: list[tuple(bool(negated), str(key), list[str(value)])]
+    """
+    terms = list()
+    for token in expression.split():
+        negated = token.startswith('!')
+        if negated:
+            token = token[1:]
+        key, sep, value = token.partition(':')
+        if sep != '' and key.isalpha() and key not in _compilers:
+            raise targetException("Unknown target key '%s'. Choose: [%s]"
+                                  % (key, ', '.join(sorted(_compilers))))
+        if sep == '' or key not in _compilers:
+            # Bare regular expression (it may contain colons)
+            key, values = 're', [token]
+        else:
+            values = [item for item in value.split(',') if item != '']
+            if key == 're':
+                values = [value]
+        if len(values) == 0:
+            raise targetException("Missing value in '%s'" % token)
+        if key == 're':
+            try:
+                values = [re.compile(values[0])]
+            except re.error as err:
+                raise targetException("Wrong regular expression '%s' (%s)"
+                                      % (values[0], err))
+        terms.append((negated, key, values))
+    return terms
+
+
+def _glob2like(glob):
+    """ Convert a glob pattern in a LIKE one with ! as escape character """
+    like = glob.replace('!', '!!').replace('%', '!%').replace('_', '!_')
+    return like.replace('*', '%').replace('?', '_')
+
+
+def _anyOf(condition, values):
+    """ Join the condition repeated once per value with OR """
+    return '(%s)' % ' or '.join([condition] * len(values))
+
+
+def _name(rt, values):
+    return (_anyOf("Object.name like %s escape '!'", values),
+            [_glob2like(value) for value in values])
+
+
+def _tag(rt, values):
+    tagIds = rt.getSubtagIds(values)
+    if len(tagIds) == 0:
+        return ('(1 = 0)', [])
+    return ("exists (select 1 from TagStorage \
+                     where TagStorage.entity_id = Object.id \
+                       and TagStorage.entity_realm = 'object' \
+                       and TagStorage.tag_id in (%s))"
+            % ','.join(['%s'] * len(tagIds)), tagIds)
+
+
+def _type(rt, values):
+    objTypes = list()
+    for value in values:
+        if value in _objTypes:
+            objTypes.append(_objTypes[value])
+        elif value.isdigit():
+            objTypes.append(int(value))
+        else:
+            raise targetException("Unknown object type '%s'" % value)
+    return ("Object.objtype_id in (%s)" % ','.join(['%s'] * len(objTypes)),
+            objTypes)
+
+
+def _os(rt, values):
+    from .racktables import _OS
+    for value in values:
+        if value not in _OS:
+            raise targetException("Unknown OS version '%s'. Choose: [%s]"
+                                  % (value, ', '.join(sorted(_OS.keys()))))
+    return ("exists (select 1 from AttributeValue \
+                     where AttributeValue.object_id = Object.id \
+                       and AttributeValue.attr_id = 4 \
+                       and AttributeValue.uint_value in (%s))"
+            % ','.join(['%s'] * len(values)),
+            [_OS[value] for value in values])
+
+
+def _model(rt, values):
+    return ("exists (select 1 from AttributeValue \
+                     inner join Dictionary \
+                     on Dictionary.dict_key = AttributeValue.uint_value \
+                     where AttributeValue.object_id = Object.id \
+                       and AttributeValue.attr_id = 2 \
+                       and %s)"
+            % _anyOf("Dictionary.dict_value like %s escape '!'", values),
+            [_glob2like(value) for value in values])
+
+
+def _net(rt, values):
+    from .racktables import ip2int
+    params = list()
+    for value in values:
+        ip, sep, mask = value.partition('/')
+        try:
+            first = ip2int(ip)
+            size = 1 << (32 - int(mask or 32))
+        except (socketError, ValueError):
+            raise targetException("Wrong network '%s'" % value)
+        first = first & ~(size - 1) & 0xffffffff
+        params.extend([first, first + size - 1])
+    return ("exists (select 1 from IPv4Allocation \
+                     where IPv4Allocation.object_id = Object.id \
+                       and %s)"
+            % _anyOf("IPv4Allocation.ip between %s and %s", values),
+            params)
+
+
+# The 're' terms have no compiler, they are applied by matchTarget()
+_compilers = {'name': _name,
+              're': None,
+              'tag': _tag,
+              'type': _type,
+              'os': _os,
+              'model': _model,
+              'net': _net}
+
+
+def compileTarget(rt, terms):
+    """
+    Build the conditions selecting the active servers matching the terms
+    (but the name regular expressions, see matchTarget)
+    Keywords:
+        @rt: (racktables) connected racktables object
+        @terms: (list) terms returned by parseTarget()
+    Return: tuple(str(where clause), list[params])
+    """
+    conditions = ["Object.objtype_id in (4,1504)",
+                  "Object.name is not null",
+                  "not exists (select 1 from AttributeValue \
+                               where AttributeValue.object_id = Object.id \
+                                 and AttributeValue.attr_id = 10010 \
+                                 and AttributeValue.uint_value = %s)"]
+    params = [rt._notRunningValue]
+    condition, tagParams = _tag(rt, rt._inactiveTags)
+    conditions.append('not (%s)' % condition)
+    params.extend(tagParams)
+    for negated, key, values in terms:
+        if key == 're':
+            continue
+        condition, termParams = _compilers[key](rt, values)
+        if negated:
+            condition = 'not (%s)' % condition
+        conditions.append(condition)
+        params.extend(termParams)
+    return (' and '.join(conditions), params)
+
+
+def matchTarget(terms, servers):
+    """
+    Filter the servers with the name regular expressions of the terms, the
+    same way (Python re.match) the local inventory does
+    Keywords:
+        @terms: (list) terms returned by parseTarget()
+        @servers: (list) tuples (id, name, type)
+    Return: list[(id,name,type), ...]
+    """
+    regexes = [(negated, values[0]) for negated, key, values in terms
+               if key == 're']
+    return [server for server in servers
+            if all([(re.match(regex, server[1]) is None) == negated
+                    for negated, regex in regexes])]
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Process level instrumentation of the SQL statements sent by trovitdb and
+the SSH sessions opened by remote. It's disabled by default, and it's
+enabled by the TROVIT_STATS environment variable or by stats.enable():
+    TROVIT_STATS=summary             print a summary at exit (stderr)
+    TROVIT_STATS=json:/path/file     append every event as a JSON line
+    TROVIT_STATS=summary,json:/path  both of them
+"""
+
+import atexit
+import json
+import re
+import sys
+import threading
+from bisect import bisect_left
+from heapq import heappush, heappushpop
+from os import environ, getpid
+from time import time
+
+# Upper bounds (seconds) of the latency histogram buckets, the last bucket
+# counts the slower ones
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+SSH_PHASES = ('connect', 'auth', 'exec', 'transfer')
+
+_literals = re.compile(r"'(?:[^'\\]|\\.|'')*'|\b\d+\b|%s")
+_lists = re.compile(r'\(\?(?:\s*,\s*\?)+\)')
+_spaces = re.compile(r'\s+')
+
+
+def normalize(sqlStmt):
+    """ Return the statement with its literals and placeholders replaced by
+    ?, the lists of them by (?,...) and the whitespace collapsed, so the
+    same query is counted only once """
+    sqlStmt = _lists.sub('(?,...)', _literals.sub('?', sqlStmt))
+    return _spaces.sub(' ', sqlStmt).strip()
+
+
+class trovitStats:
+    """
+    Counters of the SQL statements (count, time, rows, latency histogram
+    and the slowest ones) and of the SSH phases of every host. When it's
+    disabled start() returns None and the rest of the calls return at once.
+    """
+
+    def __init__(self, topN=10):
+        self.enabled = False
+        self._topN = topN
+        self._summary = False
+        self._jsonFile = None
+        self._lock = threading.Lock()
+        self.reset()
+        return
+
+    def reset(self):
+        """ Clear the collected data """
+        self._sql = dict()
+        self._slow = list()
+        self._ssh = dict()
+        return
+
+    def enable(self, summary=True, jsonPath=None):
+        """
+        Start collecting data
+        Keywords:
+            @summary: (boolean) print a summary at exit
+            @jsonPath: (str) file where the events are appended as JSON
+        Return: None
+        """
+        if jsonPath is not None:
+            try:
+                self._jsonFile = open(jsonPath, 'a')
+            except IOError as err:
+                sys.stderr.write("Error opening %s (%s)\n" % (jsonPath, err))
+        self._summary = summary
+        self.enabled = True
+        return
+
+    def disable(self):
+        """ Stop collecting data """
+        self.enabled = False
+        if self._jsonFile is not None:
+            self._jsonFile.close()
+            self._jsonFile = None
+        return
+
+    def start(self):
+        """
+        Return the start time of a measure, None if it's disabled
+        """
+        if self.enabled:
+            return time()
+        return None
+
+    def elapsed(self, started):
+        """
+        Return the seconds since started, None if it's disabled
+        """
+        if started is None:
+            return None
+        return time() - started
+
+    def sql(self, sqlStmt, started, rows=0, elapsed=None):
+        """
+        Record a SQL statement
+        Keywords:
+            @sqlStmt: (str) statement sent
+            @started: (float) value returned by start()
+            @rows: (int) rows returned or affected
+            @elapsed: (float) latency, by default the time since started
+        Return: None
+        """
+        if started is None:
+            return
+        if elapsed is None:
+            elapsed = time() - started
+        stmt = normalize(sqlStmt)
+        with self._lock:
+            entry = self._sql.get(stmt)
+            if entry is None:
+                entry = {'count': 0, 'time': 0.0, 'max': 0.0, 'rows': 0,
+                         'histogram': [0] * (len(LATENCY_BUCKETS) + 1)}
+                self._sql[stmt] = entry
+            entry['count'] += 1
+            entry['time'] += elapsed
+            entry['max'] = max(entry['max'], elapsed)
+            entry['rows'] += rows
+            entry['histogram'][bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+            if len(self._slow) < self._topN:
+                heappush(self._slow, (elapsed, stmt))
+            else:
+                heappushpop(self._slow, (elapsed, stmt))
+            self._event({'type': 'sql', 'statement': stmt,
+                         'elapsed': elapsed, 'rows': rows})
+        return
+
+    def ssh(self, hostname, phase, started, data=(), size=0):
+        """
+        Record a phase of a SSH session
+        Keywords:
+            @hostname: (str) server
+            @phase: (str) one of SSH_PHASES
+            @started: (float) value returned by start()
+            @data: (list) lists of lines transferred, to count their bytes
+            @size: (int) bytes transferred, added to the ones of data
+        Return: None
+        """
+        if started is None:
+            return
+        elapsed = time() - started
+        size += sum(len(line) for lines in data for line in lines)
+        with self._lock:
+            phases = self._ssh.setdefault(hostname, dict())
+            entry = phases.setdefault(phase, {'count': 0, 'time': 0.0,
+                                              'max': 0.0, 'bytes': 0})
+            entry['count'] += 1
+            entry['time'] += elapsed
+            entry['max'] = max(entry['max'], elapsed)
+            entry['bytes'] += size
+            self._event({'type': 'ssh', 'host': hostname, 'phase': phase,
+                         'elapsed': elapsed, 'bytes': size})
+        return
+
+    def _event(self, event):
+        """ Write an event as a JSON line (lock must be held) """
+        if self._jsonFile is not None:
+            event['time'] = time()
+            event['pid'] = getpid()
+            self._jsonFile.write('%s\n' % json.dumps(event, sort_keys=True))
+        return
+
+    def summary(self):
+        """
+        Return the collected data
+        Return: dict{'sql': dict{str(statement): dict},
+                     'slowest': list[tuple(float(seconds), str(statement))],
+                     'ssh': dict{str(host): dict{str(phase): dict}}}
+        """
+        with self._lock:
+            return {'sql': dict((stmt, dict(entry))
+                                for stmt, entry in self._sql.items()),
+                    'slowest': sorted(self._slow, reverse=True),
+                    'ssh': dict((host, dict(phases))
+                                for host, phases in self._ssh.items())}
+
+    def dump(self, fd=sys.stderr, limit=20):
+        """
+        Print a summary of the collected data
+        Keywords:
+            @fd: (file) destination, stderr by default
+            @limit: (int) statements and hosts printed
+        Return: None
+        """
+        data = self.summary()
+        statements = sorted(data['sql'].items(),
+                            key=lambda item: item[1]['time'], reverse=True)
+        fd.write("SQL: %s statements, %.3fs\n"
+                 % (sum(entry['count'] for stmt, entry in statements),
+                    sum(entry['time'] for stmt, entry in statements)))
+        fd.write("  %7s %9s %8s %9s  %s\n" % ('count', 'total(s)', 'max(s)',
+                                             'rows', 'statement'))
+        for stmt, entry in statements[:limit]:
+            fd.write("  %7d %9.3f %8.3f %9d  %s\n"
+                     % (entry['count'], entry['time'], entry['max'],
+                        entry['rows'], stmt[:100]))
+        histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        for stmt, entry in statements:
+            histogram = [total + count for total, count in
+                         zip(histogram, entry['histogram'])]
+        labels = ['<=%gs' % bound for bound in LATENCY_BUCKETS] + \
+            ['>%gs' % LATENCY_BUCKETS[-1]]
+        fd.write("  latency: %s\n" % ' '.join(
+            ['%s:%d' % (label, count)
+             for label, count in zip(labels, histogram)]))
+        fd.write("  slowest:\n")
+        for elapsed, stmt in data['slowest']:
+            fd.write("  %9.3fs  %s\n" % (elapsed, stmt[:100]))
+        hosts = sorted(data['ssh'].items(), reverse=True,
+                       key=lambda item: sum(entry['time'] for entry in
+                                            item[1].values()))
+        fd.write("SSH: %s hosts\n" % len(hosts))
+        fd.write("  %-30s %s %9s\n" % ('host', ' '.join(['%12s' % phase
+                                                         for phase in
+                                                         SSH_PHASES]),
+                                       'bytes'))
+        for host, phases in hosts[:limit]:
+            times = list()
+            for phase in SSH_PHASES:
+                entry = phases.get(phase, {'count': 0, 'time': 0.0})
+                times.append('%12s' % ('%d/%.3fs' % (entry['count'],
+                                                     entry['time'])))
+            fd.write("  %-30s %s %9d\n"
+                     % (host, ' '.join(times),
+                        phases.get('transfer', {}).get('bytes', 0)))
+        return
+
+    def _atExit(self):
+        if self.enabled and self._summary:
+            self.dump()
+        self.disable()
+        return
+
+
+stats = trovitStats()
+atexit.register(stats._atExit)
+
+
+def _configure(setting):
+    """ Enable the stats as requested by the TROVIT_STATS variable """
+    summary, jsonPath = False, None
+    for option in setting.split(','):
+        option = option.strip()
+        if option == 'summary':
+            summary = True
+        elif option.startswith('json:'):
+            jsonPath = option[5:]
+    if summary or jsonPath is not None:
+        stats.enable(summary, jsonPath)
+    return
+
+
+_configure(environ.get('TROVIT_STATS', ''))
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import sys
+import argparse
 
 try:
     from trovitdb.racktables import racktables, int2ip
@@ -11,9 +12,48 @@ except ImportError as ie:
 
 
 def main():
-    with racktables() as rt:
+    hlpDsc = "Get (and optionally allocate) free IPs from a Racktables network"
+    optParser = argparse.ArgumentParser(description=hlpDsc)
+    optParser.add_argument("-n", "--network", help="network name",
+                           metavar="STRING", required=False, type=str,
+                           dest="network", default='Backend')
+    optParser.add_argument("-r", "--reserved", help="addresses reserved at "
+                           "the start of the network", metavar="N",
+                           required=False, type=int, dest="reserved",
+                           default=205)
+    optParser.add_argument("-c", "--count", help="number of free IPs",
+                           metavar="N", required=False, type=int,
+                           dest="count", default=1)
+    optParser.add_argument("-b", "--block", help="return a block of "
+                           "consecutive IPs", required=False,
+                           action='store_true', dest="contiguous",
+                           default=False)
+    optParser.add_argument("-a", "--allocate", help="allocate the IPs to "
+                           "this server", metavar="SERVER", required=False,
+                           type=str, dest="server", default=None)
+    optParser.add_argument("-p", "--port", help="port name for the "
+                           "allocated IPs", metavar="STRING", required=False,
+                           type=str, dest="port", default='eth0')
+    args = optParser.parse_args()
+    with racktables(readOnly=args.server is None) as rt:
         rt.connect()
-        print int2ip(rt.getFreeIP('Backend', 205))
+        if args.server is None:
+            freeIps = rt.getFreeIPs(args.network, args.reserved, args.count,
+                                    args.contiguous)
+        else:
+            servers = [server for server in rt.getServersByName(args.server)
+                       if server[1] == args.server]
+            if len(servers) != 1:
+                print("Server %s not found" % args.server)
+                sys.exit(2)
+            freeIps = rt.allocateFreeIPs(args.network, args.reserved,
+                                         servers[0][0], args.port,
+                                         args.count, args.contiguous)
+        if len(freeIps) < args.count:
+            print("Not enough free IPs in %s" % args.network)
+            sys.exit(3)
+        for ip in freeIps:
+            print(int2ip(ip))
     return
 
 if __name__ == "__main__":
@@ -2,16 +2,21 @@
 # -*- coding: utf-8 -*-
 
 import sys
+import csv
+import json
+import argparse
 from time import strftime, localtime
 
 try:
     from trovitdb.racktables import racktables
+    from trovitdb.mirror import MIRROR_FILE
 except ImportError as ie:
     print(ie)
     sys.exit(1)
 
 
 fieldLen = [13, 32, 50, 12, 12]
+fieldNames = ['serviceTag', 'name', 'model', 'supportEnd', 'hwEnd']
 
 
 class fieldLenException(Exception):
@@ -44,27 +49,73 @@ def fmtTime(timestamp):
     return value
 
 
+def fmtValues(server):
+    values = []
+    values.append(server['serviceTag'])
+    values.append(server['name'])
+    values.append(server['model'])
+    values.append(fmtTime(server['supportEnd']))
+    values.append(fmtTime(server['hwEnd']))
+    return values
+
+
+def tableReport(servers):
+    border()
+    for server in servers:
+        print(fmtLine('|', fmtValues(server)))
+    border(False)
+    return
+
+
+def csvReport(servers):
+    writer = csv.writer(sys.stdout)
+    writer.writerow(fieldNames)
+    for server in servers:
+        writer.writerow([value.encode('utf-8')
+                         for value in fmtValues(server)])
+    return
+
+
+def jsonReport(servers):
+    # Written one object per row, so the report is streamed too
+    sep = '['
+    for server in servers:
+        sys.stdout.write('%s\n%s' % (sep, json.dumps(
+            dict(zip(fieldNames, fmtValues(server))), sort_keys=True)))
+        sep = ','
+    if sep == '[':
+        sys.stdout.write('[')
+    sys.stdout.write('\n]\n')
+    return
+
+
 def main():
-    with racktables() as rt:
-        border()
+    reports = {'table': tableReport,
+               'csv': csvReport,
+               'json': jsonReport}
+    hlpDsc = "Support and warranty expiration of the physical servers"
+    optParser = argparse.ArgumentParser(description=hlpDsc)
+    optParser.add_argument("-f", "--format", help="output format: [%s]"
+                           % '|'.join(sorted(reports.keys())),
+                           metavar="FORMAT", required=False, type=str,
+                           choices=reports.keys(), dest="fmt",
+                           default='table')
+    optParser.add_argument("-m", "--mirror", help="read from the local "
+                           "mirror (racktables.mirror-sync.py) instead of "
+                           "MySQL, by default %s" % MIRROR_FILE,
+                           metavar="PATH", required=False, type=str,
+                           nargs='?', const=MIRROR_FILE, dest="mirror",
+                           default=None)
+    args = optParser.parse_args()
+    with racktables(readOnly=True, mirror=args.mirror) as rt:
         rt.connect()
         try:
-            for server in rt.getPhysicalServers():
-                # server: (id,name,type)
-                if not rt.isRetired(server[0]):
-                    values = []
-                    values.append(rt.getServiceTag(server[0]))
-                    values.append(server[1])
-                    values.append(rt.getServerModel(server[0]))
-                    values.append(fmtTime(rt.getServerSupportEnd(server[0])))
-                    values.append(fmtTime(rt.getServerHwEnd(server[0])))
-                    print(fmtLine('|', values))
+            reports[args.fmt](rt.iterSupportReport())
         except fieldLenException:
             print("Wrong array length for values")
             sys.exit(2)
         except KeyboardInterrupt:
             sys.exit(3)
-        border(False)
     return
 
 if __name__ == "__main__":
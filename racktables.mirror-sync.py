@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sys
+import argparse
+
+try:
+    from trovitdb.racktables import racktables
+    from trovitdb.mirror import racktablesMirror, MIRROR_FILE
+except ImportError as ie:
+    print(ie)
+    sys.exit(1)
+
+
+def main():
+    hlpDsc = "Copy the Racktables DB to a local SQLite mirror, fetching " \
+             "only the rows changed since the last sync"
+    optParser = argparse.ArgumentParser(description=hlpDsc)
+    optParser.add_argument("-m", "--mirror", help="mirror file (default: "
+                           "%s)" % MIRROR_FILE, metavar="PATH",
+                           required=False, type=str, dest="mirror",
+                           default=MIRROR_FILE)
+    optParser.add_argument("-q", "--quiet", help="don't print the rows "
+                           "copied from each table", required=False,
+                           action='store_false', dest="verbose",
+                           default=True)
+    args = optParser.parse_args()
+    with racktables(readOnly=True) as rt:
+        rt.connect()
+        mirror = racktablesMirror(args.mirror)
+        try:
+            for table, rows in mirror.sync(rt).items():
+                if args.verbose:
+                    print("%s: %s rows copied" % (table, rows))
+        except KeyboardInterrupt:
+            sys.exit(2)
+        finally:
+            mirror.close()
+    return
+
+if __name__ == "__main__":
+    main()
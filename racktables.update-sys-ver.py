@@ -2,9 +2,10 @@
 # -*- coding: utf-8 -*-
 
 import sys
+import argparse
 
 try:
-    from remote import serverGroup, sshLoginException
+    from remote import serverGroup
     from trovitdb.racktables import racktables
 except ImportError as ie:
     print(ie)
@@ -12,20 +13,39 @@ except ImportError as ie:
 
 
 def main():
-    with racktables() as rt:
+    hlpDsc = "Update the OS version of the servers in Racktables"
+    optParser = argparse.ArgumentParser(description=hlpDsc)
+    optParser.add_argument("-P", "--parallel", help="number of servers to "
+                           "query at the same time", metavar="N",
+                           required=False, type=int, dest="workers",
+                           default=1)
+    optParser.add_argument("-r", "--refresh", help="gather the facts "
+                           "of every server again instead of using the "
+                           "cached ones",
+                           action="store_const", const=0, dest="maxAge",
+                           default=None)
+    args = optParser.parse_args()
+    with racktables() as rt, serverGroup() as sshOps:
         rt.connect()
-        sshOps = serverGroup()
         try:
-            for server in rt.getActiveServers():
-                # server: (id,name,type)
-                try:
-                    # Get 1 char to know the OS version
-                    osVer = sshOps.sshCmd(server[1], "cat "
-                                          "/etc/debian_version",
-                                          sync=True)[0][0][0]
-                except sshLoginException as sLE:
-                    print(sLE)
-                else:
+            servers = rt.getActiveServers()
+            # OS version attribute of every server in a single query
+            rt.prefetchAttributes([server[0] for server in servers], [4])
+            facts, errors = sshOps.collectFacts(
+                [server[1] for server in servers], workers=args.workers,
+                maxAge=args.maxAge)
+            # Every version is written alone: keep the ones already queued
+            # if the loop is interrupted
+            with rt.batch(flushOnError=True) as writer:
+                for server in servers:
+                    # server: (id,name,type)
+                    if server[1] in errors:
+                        print(errors[server[1]])
+                        continue
+                    if server[1] not in facts:
+                        continue
+                    # Major version (8.11 -> 8)
+                    osVer = facts[server[1]]['os'].split('.')[0]
                     if osVer != '':
                         rtVer = rt.getServerVersion(server[0])
                         if rtVer == '':
@@ -39,7 +59,10 @@ def main():
                                       % (server[1], rtVer, osVer))
                                 rt.updateVersion(server[0], osVer)
                     else:
-                        print("Error getting OS version from %s" % server[1])
+                        print("Error getting OS version from %s"
+                              % server[1])
+            for sqlStmt, params, error in writer.failures:
+                print("Error writing OS version %s: %s" % (params, error))
         except KeyboardInterrupt:
             sys.exit(2)
     return
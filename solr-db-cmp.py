@@ -14,12 +14,33 @@ except ImportError as ie:
 
 
 def main():
-    solrParser = solrXml.solrXmlParser()
-    with trovitGlobal() as tg:
+    optParser = ArgumentParser()
+    optParser.add_argument('-P', '--parallel',
+                           help='Number of servers queried at the same time',
+                           metavar='N', required=False, type=int,
+                           default=8, dest='workers')
+    optParser.add_argument('--timeout',
+                           help='Timeout (seconds) of each STATUS request',
+                           metavar='SECONDS', required=False, type=int,
+                           default=30, dest='timeout')
+    optParser.add_argument('-f', '--format',
+                           help='Format of the STATUS responses: [xml|json] '
+                           '(by default the one in the configuration)',
+                           metavar='FORMAT', required=False, type=str,
+                           choices=['xml', 'json'], default=None,
+                           dest='fmt')
+    args = optParser.parse_args()
+    solrParser = solrXml.solrXmlParser(args.timeout, args.fmt)
+    with trovitGlobal(readOnly=True) as tg:
         tg.connect()
         servers = tg.getAllCores(dKey='server')
-        for server in servers.keys():
-            realCores = solrParser.getCores(solrParser.getXml(server))
+        statuses, errors = solrParser.collectStatus(servers.keys(),
+                                                    args.workers)
+        for server in sorted(errors.keys()):
+            print "Error getting STATUS from %s (%s)" % (server,
+                                                       errors[server])
+        for server in statuses.keys():
+            realCores = statuses[server].keys()
             for rCore in realCores:
                 if rCore not in servers[server]:
                     print "%s in %s but not in DB" % (rCore, server)
@@ -6,6 +6,7 @@ from argparse import ArgumentParser
 
 try:
     from trovitdb.racktables import racktables
+    from trovitdb.mirror import MIRROR_FILE
     import solrXml
 except ImportError as ie:
     print(ie)
@@ -39,18 +40,45 @@ def main():
                            help='Show servers information',
                            action='store_true', required=False,
                            default=True, dest='showServers')
+    optParser.add_argument('-P', '--parallel',
+                           help='Number of servers queried at the same time',
+                           metavar='N', required=False, type=int,
+                           default=8, dest='workers')
+    optParser.add_argument('--timeout',
+                           help='Timeout (seconds) of each STATUS request',
+                           metavar='SECONDS', required=False, type=int,
+                           default=30, dest='timeout')
+    optParser.add_argument('-f', '--format',
+                           help='Format of the STATUS responses: [xml|json] '
+                           '(by default the one in the configuration)',
+                           metavar='FORMAT', required=False, type=str,
+                           choices=['xml', 'json'], default=None,
+                           dest='fmt')
+    optParser.add_argument('-m', '--mirror',
+                           help='Read the servers from the local mirror '
+                           '(racktables.mirror-sync.py) instead of MySQL, '
+                           'by default %s' % MIRROR_FILE,
+                           metavar='PATH', required=False, type=str,
+                           nargs='?', const=MIRROR_FILE, dest='mirror',
+                           default=None)
     try:
         args = optParser.parse_args()
     except IOError as ioe:
         print("%s: %s" % (ioe.filename, ioe.strerror))
         sys.exit(1)
-    with racktables() as rt:
+    with racktables(readOnly=True, mirror=args.mirror) as rt:
         rt.connect()
-        solrParser = solrXml.solrXmlParser()
+        solrParser = solrXml.solrXmlParser(args.timeout, args.fmt)
         servers = []
         map(lambda x: servers.append(x[1]), rt.getServersByName(args.solrType))
+        statuses, errors = solrParser.collectStatus(servers, args.workers)
+        for server in sorted(errors.keys()):
+            print "Error getting STATUS from %s (%s)" % (server,
+                                                       errors[server])
         for server in servers:
-            results = solrParser.getSizes(solrParser.getXml(server))
+            if server not in statuses:
+                continue
+            results = solrParser.statusSizes(statuses[server])
             for core in results.keys():
                 if core == 'total':
                     cores[server] = results[core]